@@ -2,40 +2,110 @@
 FastAPI приложение для PC-Guardian Server
 """
 import os
+import asyncio
+import hashlib
+import logging
+import orjson
+import threading
 from contextlib import asynccontextmanager
+from anyio import to_thread
 from fastapi import FastAPI, Depends, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
-from jinja2 import Environment, FileSystemLoader
-from sqlalchemy.orm import Session
-from typing import Optional
+from jinja2 import Environment, FileSystemLoader, Template
+from sqlalchemy import select, func, update, delete, and_, exists, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload, joinedload
+from typing import Optional, Literal
+from cachetools import TTLCache
 from datetime import datetime, timedelta
 
-from database import get_db, Base, engine, PC, PCConfiguration, ChangeEvent, User, Room, Camera
+from database import get_db, Base, engine, SessionLocal, PC, PCConfiguration, ChangeEvent, User, Room, Camera, _iso
 from kafka_consumer import PCGuardianConsumer
 from common.kafka_config import KafkaConfig
-from auth import get_current_user, verify_password, create_access_token
-from pydantic import BaseModel as PydanticBaseModel
-
-# Создаем таблицы БД
-Base.metadata.create_all(bind=engine)
+from auth import get_current_user, check_user_password, create_access_token, invalidate_token
+from pydantic import BaseModel as PydanticBaseModel, ConfigDict
 
 # Инициализация Kafka Consumer
 kafka_config = KafkaConfig()
 consumer = None
 
+# Создавать таблицы БД при старте приложения (обычно схему создает init_db.py)
+AUTO_CREATE_SCHEMA = os.getenv('AUTO_CREATE_SCHEMA') == '1'
+
+# Размер пула потоков для синхронных обработчиков (запросы к БД, проверка паролей bcrypt)
+THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', '40'))
+
+# ПК считается offline, если не выходил на связь дольше этого порога
+OFFLINE_DELTA = timedelta(minutes=10)
+# Период, за который на дашборде показывается количество последних событий
+RECENT_EVENTS_DELTA = timedelta(days=7)
+
+# Период фонового обновления статуса offline (в секундах)
+OFFLINE_CHECK_INTERVAL = int(os.getenv('OFFLINE_CHECK_INTERVAL', '60'))
+
+logger = logging.getLogger(__name__)
+
+
+def update_offline_status(db: Session, offline_delta: timedelta = OFFLINE_DELTA):
+    """Обновить статус ПК на 'offline' если они не были в сети дольше порога"""
+    threshold = datetime.utcnow() - offline_delta
+    
+    # Одним UPDATE помечаем ПК, которые не были в сети дольше порога
+    result = db.execute(
+        update(PC)
+        .where(
+            PC.last_seen.isnot(None),
+            PC.last_seen < threshold,
+            PC.status != 'offline'
+        )
+        .values(status='offline')
+        .execution_options(synchronize_session=False)
+    )
+    
+    if result.rowcount:
+        db.commit()
+
+
+def run_offline_status_update():
+    """Обновить статус offline в отдельной сессии БД"""
+    db = SessionLocal()
+    try:
+        update_offline_status(db)
+    finally:
+        db.close()
+
+
+async def offline_status_loop():
+    """Фоновая задача: периодически обновлять статус offline вне обработки запросов"""
+    while True:
+        try:
+            await asyncio.to_thread(run_offline_status_update)
+        except Exception as e:
+            logger.error(f"Ошибка обновления статуса offline: {e}", exc_info=True)
+        await asyncio.sleep(OFFLINE_CHECK_INTERVAL)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
     global consumer
     # Запуск при старте
+    to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+    if AUTO_CREATE_SCHEMA:
+        await asyncio.to_thread(Base.metadata.create_all, bind=engine)
     consumer = PCGuardianConsumer(kafka_config)
     consumer.start()
+    offline_task = asyncio.create_task(offline_status_loop())
     yield
     # Остановка при завершении
     if consumer:
         consumer.stop()
+    offline_task.cancel()
+    try:
+        await offline_task
+    except asyncio.CancelledError:
+        pass
 
 
 app = FastAPI(
@@ -46,7 +116,13 @@ app = FastAPI(
 )
 
 # Настройка шаблонов
-templates = Environment(loader=FileSystemLoader("templates"))
+templates = Environment(loader=FileSystemLoader("templates"), auto_reload=False, cache_size=-1)
+
+# Компилируем шаблоны один раз при старте, чтобы не обращаться к загрузчику на каждый запрос
+TEMPLATES: dict[str, Template] = {
+    name: templates.get_template(name)
+    for name in ["dashboard.html", "pc_detail.html", "events.html", "admin.html", "login.html"]
+}
 
 # Статические файлы
 if os.path.exists("static"):
@@ -54,6 +130,8 @@ if os.path.exists("static"):
 
 
 # ==================== API Endpoints ====================
+# Обработчики, работающие с БД, объявлены синхронными (def): FastAPI выполняет их
+# в пуле потоков, поэтому блокирующие запросы SQLAlchemy не останавливают event loop.
 
 def require_admin(current_user: User = Depends(get_current_user)):
     """Вспомогательная функция для проверки прав администратора"""
@@ -61,113 +139,161 @@ def require_admin(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
-def update_offline_status(db: Session, offline_threshold_minutes: int = 10):
-    """Обновить статус ПК на 'offline' если они не были в сети дольше порога"""
-    threshold = datetime.utcnow() - timedelta(minutes=offline_threshold_minutes)
-    
-    # Находим ПК, которые не были в сети дольше порога
-    offline_pcs = db.query(PC).filter(
-        PC.last_seen.isnot(None),
-        PC.last_seen < threshold,
-        PC.status != 'offline'
-    ).all()
-    
-    for pc in offline_pcs:
-        pc.status = 'offline'
-    
-    if offline_pcs:
-        db.commit()
+# Кэш общего количества записей для журналов событий: change_events только растет,
+# и точный COUNT по всей выборке не нужен на каждой странице (хранится TOTAL_CACHE_TTL секунд)
+TOTAL_CACHE_TTL = int(os.getenv('TOTAL_CACHE_TTL', '10'))
+_total_cache = TTLCache(maxsize=1024, ttl=TOTAL_CACHE_TTL)
+_total_cache_lock = threading.Lock()
+
+def paginate(query, skip: int, limit: int, total_cache_key: Optional[tuple] = None):
+    """
+    Получить страницу и общее количество записей одним запросом (оконный COUNT)
+    
+    Args:
+        total_cache_key: Ключ для кэширования общего количества; пока значение в кэше,
+            запрос страницы выполняется без оконной функции
+    
+    Returns:
+        Строки страницы (с дополнительным последним столбцом total) и общее количество
+    """
+    if total_cache_key is not None:
+        with _total_cache_lock:
+            total = _total_cache.get(total_cache_key)
+        if total is not None:
+            rows = query.add_columns(literal(total).label('total')).offset(skip).limit(limit).all()
+            return rows, total
+    
+    rows = query.add_columns(func.count().over().label('total')).offset(skip).limit(limit).all()
+    if rows:
+        total = rows[0].total
+    else:
+        # Страница за пределами выборки: общее количество считаем отдельно
+        total = query.order_by(None).count() if skip else 0
+    
+    if total_cache_key is not None:
+        with _total_cache_lock:
+            _total_cache[total_cache_key] = total
+    
+    return rows, total
+
+# Заголовок Cache-Control для часто опрашиваемых эндпоинтов: браузер хранит ответ, но каждый
+# опрос перепроверяет его по ETag, поэтому изменения (например, смена эталона) видны сразу
+POLLING_CACHE_CONTROL = 'private, no-cache'
+
+def cached_json_response(request: Request, content) -> Response:
+    """JSON-ответ с ETag по содержимому: повторный опрос без изменений получает 304"""
+    response = Response(content=orjson.dumps(content), media_type='application/json')
+    etag = '"' + hashlib.blake2b(response.body, digest_size=16).hexdigest() + '"'
+    headers = {'ETag': etag, 'Cache-Control': POLLING_CACHE_CONTROL}
+    
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    return response
+
+# Столбцы ПК для списка: выбираем их напрямую, без создания ORM-объектов
+PC_LIST_COLUMNS = (PC.id, PC.pc_id, PC.hostname, PC.room_id, PC.registered_at, PC.last_seen, PC.status)
+PC_LIST_FIELDS = tuple(column.key for column in PC_LIST_COLUMNS)
 
-@app.get("/api/pcs", response_class=JSONResponse)
-async def get_pcs(
+@app.get("/api/pcs")
+def get_pcs(
     request: Request,
     skip: int = 0,
     limit: int = 100,
     status: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
-):
+) -> Response:
     """Получить список ПК"""
-    # Обновляем статус offline перед получением списка
-    update_offline_status(db, offline_threshold_minutes=10)
-    
-    query = db.query(PC)
+    query = db.query(*PC_LIST_COLUMNS)
     
     if status:
         query = query.filter(PC.status == status)
     
-    pcs = query.offset(skip).limit(limit).all()
-    total = query.count()
+    rows, total = paginate(query, skip, limit)
     
-    return {
+    return cached_json_response(request, {
         "total": total,
-        "items": [pc.to_dict() for pc in pcs]
-    }
-
-
-@app.get("/api/pcs/{pc_id}", response_class=JSONResponse)
-async def get_pc(
+        # Даты в том же формате, что и в PC.to_dict (до секунд)
+        "items": [
+            {
+                **dict(zip(PC_LIST_FIELDS, row)),
+                'registered_at': _iso(row.registered_at),
+                'last_seen': _iso(row.last_seen),
+            }
+            for row in rows
+        ]
+    })
+
+
+@app.get("/api/pcs/{pc_id}")
+def get_pc(
     pc_id: str,
     request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
-):
+) -> Response:
     """Получить информацию о ПК"""
-    # Обновляем статус offline перед получением информации
-    update_offline_status(db, offline_threshold_minutes=10)
-    
     pc = db.query(PC).filter(PC.pc_id == pc_id).first()
     if not pc:
         raise HTTPException(status_code=404, detail="PC not found")
     
-    # Получаем эталонную конфигурацию
-    baseline = db.query(PCConfiguration).filter_by(
-        pc_id=pc_id,
-        is_baseline=True
-    ).first()
+    # Получаем эталонную и последнюю конфигурации одним запросом
+    baseline_id = select(PCConfiguration.id).where(
+        PCConfiguration.pc_id == pc_id,
+        PCConfiguration.is_baseline == True
+    ).limit(1).scalar_subquery()
     
-    # Получаем последнюю конфигурацию
-    latest = db.query(PCConfiguration).filter_by(
-        pc_id=pc_id,
-        is_baseline=False
-    ).order_by(PCConfiguration.timestamp.desc()).first()
+    latest_id = select(PCConfiguration.id).where(
+        PCConfiguration.pc_id == pc_id,
+        PCConfiguration.is_baseline == False
+    ).order_by(PCConfiguration.timestamp.desc()).limit(1).scalar_subquery()
+    
+    configs = db.query(PCConfiguration).filter(
+        PCConfiguration.id.in_([baseline_id, latest_id])
+    ).all()
+    
+    baseline = next((c for c in configs if c.is_baseline), None)
+    latest = next((c for c in configs if not c.is_baseline), None)
     
     result = pc.to_dict()
     result['baseline_config'] = baseline.to_dict() if baseline else None
     result['latest_config'] = latest.to_dict() if latest else None
     
-    return result
+    return cached_json_response(request, result)
 
 
-@app.get("/api/pcs/{pc_id}/events", response_class=JSONResponse)
-async def get_pc_events(
+@app.get("/api/pcs/{pc_id}/events")
+def get_pc_events(
     pc_id: str,
     request: Request,
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
-):
+) -> Response:
     """Получить события для ПК"""
-    events = db.query(ChangeEvent).filter(
+    query = db.query(ChangeEvent).filter(
         ChangeEvent.pc_id == pc_id
-    ).order_by(ChangeEvent.timestamp.desc()).offset(skip).limit(limit).all()
+    ).order_by(ChangeEvent.timestamp.desc())
     
-    total = db.query(ChangeEvent).filter(ChangeEvent.pc_id == pc_id).count()
+    rows, total = paginate(query, skip, limit, total_cache_key=('events', pc_id, None))
     
-    return {
+    return Response(content=orjson.dumps({
         "total": total,
-        "items": [event.to_dict() for event in events]
-    }
+        "items": [event.to_dict() for event, _ in rows]
+    }), media_type='application/json')
 
 
-@app.post("/api/pcs/{pc_id}/baseline", response_class=JSONResponse)
-async def set_baseline(
+@app.post("/api/pcs/{pc_id}/baseline")
+def set_baseline(
     pc_id: str,
     request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
-):
+) -> dict:
     """Установить текущую конфигурацию как эталонную"""
     if current_user.role != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -200,8 +326,8 @@ async def set_baseline(
     return {"message": "Baseline configuration updated", "pc_id": pc_id}
 
 
-@app.get("/api/events", response_class=JSONResponse)
-async def get_events(
+@app.get("/api/events")
+def get_events(
     request: Request,
     skip: int = 0,
     limit: int = 100,
@@ -209,7 +335,7 @@ async def get_events(
     component_type: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
-):
+) -> Response:
     """Получить все события"""
     query = db.query(ChangeEvent)
     
@@ -218,65 +344,75 @@ async def get_events(
     if component_type:
         query = query.filter(ChangeEvent.component_type == component_type)
     
-    events = query.order_by(ChangeEvent.timestamp.desc()).offset(skip).limit(limit).all()
-    total = query.count()
+    rows, total = paginate(
+        query.order_by(ChangeEvent.timestamp.desc()), skip, limit,
+        total_cache_key=('events', pc_id, component_type)
+    )
     
-    return {
+    return Response(content=orjson.dumps({
         "total": total,
-        "items": [event.to_dict() for event in events]
-    }
+        "items": [event.to_dict() for event, _ in rows]
+    }), media_type='application/json')
 
 
-@app.get("/api/stats", response_class=JSONResponse)
-async def get_stats(
+@app.get("/api/stats")
+def get_stats(
     request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
-):
+) -> Response:
     """Получить статистику"""
-    # Обновляем статус offline перед подсчетом статистики
-    update_offline_status(db, offline_threshold_minutes=10)
-    
-    total_pcs = db.query(PC).count()
-    normal_pcs = db.query(PC).filter(PC.status == 'normal').count()
-    changed_pcs = db.query(PC).filter(PC.status == 'changed').count()
-    
-    # Подсчитываем offline ПК (используем тот же порог - 10 минут)
-    offline_threshold = datetime.utcnow() - timedelta(minutes=10)
-    offline_pcs = db.query(PC).filter(
-        PC.last_seen.isnot(None),
-        PC.last_seen < offline_threshold
-    ).count()
-    
-    recent_events = db.query(ChangeEvent).filter(
-        ChangeEvent.timestamp >= datetime.utcnow() - timedelta(days=7)
-    ).count()
-    
-    return {
-        "total_pcs": total_pcs,
-        "normal_pcs": normal_pcs,
-        "changed_pcs": changed_pcs,
-        "offline_pcs": offline_pcs,
-        "recent_events": recent_events
-    }
+    now = datetime.utcnow()
+    # Подсчитываем offline ПК (используем тот же порог, что и фоновое обновление статуса)
+    offline_threshold = now - OFFLINE_DELTA
+    
+    recent_events = select(func.count()).select_from(ChangeEvent).where(
+        ChangeEvent.timestamp >= now - RECENT_EVENTS_DELTA
+    ).scalar_subquery()
+    
+    # Все счетчики за один проход по таблице pcs (COUNT ... FILTER) и один запрос к БД
+    stats = db.execute(
+        select(
+            func.count().label('total_pcs'),
+            func.count().filter(PC.status == 'normal').label('normal_pcs'),
+            func.count().filter(PC.status == 'changed').label('changed_pcs'),
+            func.count().filter(and_(
+                PC.last_seen.isnot(None),
+                PC.last_seen < offline_threshold
+            )).label('offline_pcs'),
+            recent_events.label('recent_events')
+        ).select_from(PC)
+    ).one()
+    
+    return cached_json_response(request, {
+        "total_pcs": stats.total_pcs,
+        "normal_pcs": stats.normal_pcs,
+        "changed_pcs": stats.changed_pcs,
+        "offline_pcs": stats.offline_pcs,
+        "recent_events": stats.recent_events
+    })
 
 
 # ==================== Admin API Endpoints (Rooms) ====================
 
 class RoomCreate(PydanticBaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
     name: str
     description: Optional[str] = None
 
 class RoomUpdate(PydanticBaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
     name: Optional[str] = None
     description: Optional[str] = None
 
-@app.get("/api/admin/rooms", response_class=JSONResponse)
-async def get_rooms(
+@app.get("/api/admin/rooms")
+def get_rooms(
     request: Request,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Получить список всех аудиторий"""
     rooms = db.query(Room).all()
     return {
@@ -284,15 +420,18 @@ async def get_rooms(
         "items": [room.to_dict() for room in rooms]
     }
 
-@app.get("/api/admin/rooms/{room_id}", response_class=JSONResponse)
-async def get_room(
+@app.get("/api/admin/rooms/{room_id}")
+def get_room(
     room_id: int,
     request: Request,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Получить информацию об аудитории"""
-    room = db.query(Room).filter(Room.id == room_id).first()
+    room = db.query(Room).options(
+        selectinload(Room.pcs),
+        selectinload(Room.cameras)
+    ).filter(Room.id == room_id).first()
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
@@ -303,76 +442,77 @@ async def get_room(
     
     return result
 
-@app.post("/api/admin/rooms", response_class=JSONResponse)
-async def create_room(
+@app.post("/api/admin/rooms")
+def create_room(
     room_data: RoomCreate,
     request: Request,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Создать новую аудиторию"""
-    # Проверяем, не существует ли уже аудитория с таким именем
-    existing = db.query(Room).filter(Room.name == room_data.name).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Room with this name already exists")
-    
     room = Room(
         name=room_data.name,
         description=room_data.description
     )
     db.add(room)
-    db.commit()
+    # Уникальность имени проверяет ограничение UNIQUE на rooms.name
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Room with this name already exists")
     db.refresh(room)
     
     return {"message": "Room created", "room": room.to_dict()}
 
-@app.put("/api/admin/rooms/{room_id}", response_class=JSONResponse)
-async def update_room(
+@app.put("/api/admin/rooms/{room_id}")
+def update_room(
     room_id: int,
     room_data: RoomUpdate,
     request: Request,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Обновить информацию об аудитории"""
     room = db.query(Room).filter(Room.id == room_id).first()
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
-    if room_data.name is not None:
-        # Проверяем, не занято ли имя другой аудиторией
-        existing = db.query(Room).filter(Room.name == room_data.name, Room.id != room_id).first()
-        if existing:
-            raise HTTPException(status_code=400, detail="Room with this name already exists")
-        room.name = room_data.name
+    # Переданные поля со значением null, как и раньше, не изменяют аудиторию
+    changes = room_data.model_dump(exclude_unset=True, exclude_none=True)
     
-    if room_data.description is not None:
-        room.description = room_data.description
+    for field, value in changes.items():
+        setattr(room, field, value)
     
-    db.commit()
+    # Занятость имени другой аудиторией проверяет ограничение UNIQUE на rooms.name
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Room with this name already exists")
     db.refresh(room)
     
     return {"message": "Room updated", "room": room.to_dict()}
 
-@app.delete("/api/admin/rooms/{room_id}", response_class=JSONResponse)
-async def delete_room(
+@app.delete("/api/admin/rooms/{room_id}")
+def delete_room(
     room_id: int,
     request: Request,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Удалить аудиторию"""
-    room = db.query(Room).filter(Room.id == room_id).first()
-    if not room:
+    if not db.scalar(select(exists().where(Room.id == room_id))):
         raise HTTPException(status_code=404, detail="Room not found")
     
-    # Проверяем, есть ли связанные ПК или камеры
-    if room.pcs:
+    # Проверяем, есть ли связанные ПК или камеры, не загружая коллекции
+    if db.scalar(select(exists().where(PC.room_id == room_id))):
         raise HTTPException(status_code=400, detail="Cannot delete room with associated PCs")
-    if room.cameras:
+    if db.scalar(select(exists().where(Camera.room_id == room_id))):
         raise HTTPException(status_code=400, detail="Cannot delete room with associated cameras")
     
-    db.delete(room)
+    # Связанных записей нет, поэтому удаляем без ORM (db.delete загрузил бы pcs и cameras)
+    db.execute(delete(Room).where(Room.id == room_id))
     db.commit()
     
     return {"message": "Room deleted"}
@@ -380,27 +520,34 @@ async def delete_room(
 
 # ==================== Admin API Endpoints (Cameras) ====================
 
+# Допустимые статусы камеры проверяются валидатором Pydantic при разборе тела запроса
+CameraStatus = Literal['active', 'inactive', 'error']
+
 class CameraCreate(PydanticBaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
     name: str
     room_id: int
-    status: Optional[str] = "inactive"
+    status: Optional[CameraStatus] = "inactive"
     device_id: Optional[str] = None
     ip_address: Optional[str] = None
 
 class CameraUpdate(PydanticBaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
     name: Optional[str] = None
     room_id: Optional[int] = None
-    status: Optional[str] = None
+    status: Optional[CameraStatus] = None
     device_id: Optional[str] = None
     ip_address: Optional[str] = None
 
-@app.get("/api/admin/cameras", response_class=JSONResponse)
-async def get_cameras(
+@app.get("/api/admin/cameras")
+def get_cameras(
     request: Request,
     room_id: Optional[int] = None,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Получить список всех камер"""
     query = db.query(Camera)
     
@@ -413,15 +560,17 @@ async def get_cameras(
         "items": [camera.to_dict() for camera in cameras]
     }
 
-@app.get("/api/admin/cameras/{camera_id}", response_class=JSONResponse)
-async def get_camera(
+@app.get("/api/admin/cameras/{camera_id}")
+def get_camera(
     camera_id: int,
     request: Request,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Получить информацию о камере"""
-    camera = db.query(Camera).filter(Camera.id == camera_id).first()
+    camera = db.query(Camera).options(
+        joinedload(Camera.room)
+    ).filter(Camera.id == camera_id).first()
     if not camera:
         raise HTTPException(status_code=404, detail="Camera not found")
     
@@ -430,23 +579,18 @@ async def get_camera(
     
     return result
 
-@app.post("/api/admin/cameras", response_class=JSONResponse)
-async def create_camera(
+@app.post("/api/admin/cameras")
+def create_camera(
     camera_data: CameraCreate,
     request: Request,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Создать новую камеру"""
     # Проверяем, существует ли аудитория
-    room = db.query(Room).filter(Room.id == camera_data.room_id).first()
-    if not room:
+    if not db.scalar(select(exists().where(Room.id == camera_data.room_id))):
         raise HTTPException(status_code=404, detail="Room not found")
     
-    # Проверяем статус
-    if camera_data.status not in ['active', 'inactive', 'error']:
-        raise HTTPException(status_code=400, detail="Invalid status. Must be: active, inactive, or error")
-    
     camera = Camera(
         name=camera_data.name,
         room_id=camera_data.room_id,
@@ -460,52 +604,42 @@ async def create_camera(
     
     return {"message": "Camera created", "camera": camera.to_dict()}
 
-@app.put("/api/admin/cameras/{camera_id}", response_class=JSONResponse)
-async def update_camera(
+@app.put("/api/admin/cameras/{camera_id}")
+def update_camera(
     camera_id: int,
     camera_data: CameraUpdate,
     request: Request,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Обновить информацию о камере"""
     camera = db.query(Camera).filter(Camera.id == camera_id).first()
     if not camera:
         raise HTTPException(status_code=404, detail="Camera not found")
     
-    if camera_data.name is not None:
-        camera.name = camera_data.name
+    # Переданные поля со значением null, как и раньше, не изменяют камеру
+    changes = camera_data.model_dump(exclude_unset=True, exclude_none=True)
     
-    if camera_data.room_id is not None:
+    if 'room_id' in changes:
         # Проверяем, существует ли аудитория
-        room = db.query(Room).filter(Room.id == camera_data.room_id).first()
-        if not room:
+        if not db.scalar(select(exists().where(Room.id == changes['room_id']))):
             raise HTTPException(status_code=404, detail="Room not found")
-        camera.room_id = camera_data.room_id
-    
-    if camera_data.status is not None:
-        if camera_data.status not in ['active', 'inactive', 'error']:
-            raise HTTPException(status_code=400, detail="Invalid status. Must be: active, inactive, or error")
-        camera.status = camera_data.status
-    
-    if camera_data.device_id is not None:
-        camera.device_id = camera_data.device_id
     
-    if camera_data.ip_address is not None:
-        camera.ip_address = camera_data.ip_address
+    for field, value in changes.items():
+        setattr(camera, field, value)
     
     db.commit()
     db.refresh(camera)
     
     return {"message": "Camera updated", "camera": camera.to_dict()}
 
-@app.delete("/api/admin/cameras/{camera_id}", response_class=JSONResponse)
-async def delete_camera(
+@app.delete("/api/admin/cameras/{camera_id}")
+def delete_camera(
     camera_id: int,
     request: Request,
     db: Session = Depends(get_db),
     admin_user: User = Depends(require_admin)
-):
+) -> dict:
     """Удалить камеру"""
     camera = db.query(Camera).filter(Camera.id == camera_id).first()
     if not camera:
@@ -522,12 +656,11 @@ async def delete_camera(
 @app.get("/", response_class=HTMLResponse)
 async def dashboard(request: Request, current_user: User = Depends(get_current_user)):
     """Главная страница - дашборд"""
-    template = templates.get_template("dashboard.html")
-    return HTMLResponse(template.render(request=request, user=current_user))
+    return HTMLResponse(TEMPLATES["dashboard.html"].render(request=request, user=current_user))
 
 
 @app.get("/pc/{pc_id}", response_class=HTMLResponse)
-async def pc_detail(
+def pc_detail(
     pc_id: str,
     request: Request,
     db: Session = Depends(get_db),
@@ -538,8 +671,7 @@ async def pc_detail(
     if not pc:
         raise HTTPException(status_code=404, detail="PC not found")
     
-    template = templates.get_template("pc_detail.html")
-    return HTMLResponse(template.render(request=request, user=current_user, pc=pc))
+    return HTMLResponse(TEMPLATES["pc_detail.html"].render(request=request, user=current_user, pc=pc))
 
 
 @app.get("/events", response_class=HTMLResponse)
@@ -548,8 +680,7 @@ async def events_page(
     current_user: User = Depends(get_current_user)
 ):
     """Страница журнала событий"""
-    template = templates.get_template("events.html")
-    return HTMLResponse(template.render(request=request, user=current_user))
+    return HTMLResponse(TEMPLATES["events.html"].render(request=request, user=current_user))
 
 
 @app.get("/admin", response_class=HTMLResponse)
@@ -558,12 +689,11 @@ async def admin_panel(
     admin_user: User = Depends(require_admin)
 ):
     """Страница админ-панели"""
-    template = templates.get_template("admin.html")
-    return HTMLResponse(template.render(request=request, user=admin_user))
+    return HTMLResponse(TEMPLATES["admin.html"].render(request=request, user=admin_user))
 
 
 @app.get("/login", response_class=HTMLResponse)
-async def login_page(request: Request, db: Session = Depends(get_db)):
+def login_page(request: Request, db: Session = Depends(get_db)):
     """Страница входа"""
     # Проверяем, есть ли уже активная сессия
     from auth import get_user_from_token
@@ -574,19 +704,18 @@ async def login_page(request: Request, db: Session = Depends(get_db)):
         if user:
             return RedirectResponse(url="/", status_code=303)
     
-    template = templates.get_template("login.html")
-    return HTMLResponse(template.render(request=request))
+    return HTMLResponse(TEMPLATES["login.html"].render(request=request))
 
 
 @app.post("/login")
-async def login(
+def login(
     username: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(get_db)
 ):
     """Обработка входа"""
     user = db.query(User).filter(User.username == username).first()
-    if not user or not verify_password(password, user.password_hash):
+    if not check_user_password(user, password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not user.is_active:
@@ -609,8 +738,10 @@ async def login(
     return response
 
 @app.get("/logout")
-async def logout():
+async def logout(request: Request):
     """Выход из системы"""
+    invalidate_token(request.cookies.get("session_token"))
+    
     response = RedirectResponse(url="/login", status_code=303)
     response.delete_cookie(key="session_token")
     return response
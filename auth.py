@@ -1,13 +1,21 @@
 """
 Модуль аутентификации для PC-Guardian
 """
+import binascii
 import bcrypt
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Tuple
+from cachetools import TTLCache
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status, Request, Cookie
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.security import HTTPBasic
+from sqlalchemy import select, exists
 from sqlalchemy.orm import Session
 
 from database import get_db, User
@@ -19,6 +27,25 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
+# Стоимость bcrypt (2^rounds итераций); для тестов и разработки можно уменьшить до 4
+_BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Кэш проверенных JWT: ключ sha256(token), значение - payload. Повторные запросы с тем же cookie
+# не выполняют jwt.decode; срок действия (exp) проверяется и для записей из кэша.
+_jwt_cache = TTLCache(maxsize=10_000, ttl=5)
+_jwt_cache_lock = threading.Lock()
+
+# Кэш активных пользователей по username для запросов с токеном сессии (без SELECT на каждый запрос).
+# Отключение пользователя вступает в силу не позже TTL.
+_user_cache = TTLCache(maxsize=10_000, ttl=30)
+_user_cache_lock = threading.Lock()
+
+# Кэш успешных проверок HTTP Basic Auth: ключ (username, sha256(password)), значение - пользователь.
+# Повторные запросы с теми же учетными данными не выполняют bcrypt. Неудачные попытки не кэшируются;
+# смена пароля или отключение пользователя вступают в силу не позже TTL.
+_basic_auth_cache = TTLCache(maxsize=10_000, ttl=10)
+_basic_auth_cache_lock = threading.Lock()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Создать JWT токен"""
     to_encode = data.copy()
@@ -32,11 +59,46 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 def verify_token(token: str) -> Optional[dict]:
     """Проверить JWT токен"""
+    cache_key = hashlib.sha256(token.encode('utf-8')).digest()
+    with _jwt_cache_lock:
+        payload = _jwt_cache.get(cache_key)
+    if payload is not None and payload.get("exp", 0) > time.time():
+        return payload
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    
+    with _jwt_cache_lock:
+        _jwt_cache[cache_key] = payload
+    return payload
+
+
+# Отдельный пул для bcrypt: вычисления освобождают GIL и идут параллельно на всех ядрах,
+# а число одновременных хеширований не превышает числа ядер даже при всплеске входов
+_BCRYPT_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="bcrypt")
+
+
+def _checkpw(password_bytes: bytes, hash_bytes: bytes) -> bool:
+    """Проверить пароль bcrypt в пуле _BCRYPT_POOL"""
+    return _BCRYPT_POOL.submit(bcrypt.checkpw, password_bytes, hash_bytes).result()
+
+
+def _hashpw(password_bytes: bytes, salt: bytes) -> bytes:
+    """Вычислить хеш bcrypt в пуле _BCRYPT_POOL"""
+    return _BCRYPT_POOL.submit(bcrypt.hashpw, password_bytes, salt).result()
+
+
+# Фиктивный хеш для проверки пароля несуществующего пользователя (та же стоимость, что у настоящих)
+_DUMMY_HASH = bcrypt.hashpw(b"x", bcrypt.gensalt(rounds=_BCRYPT_ROUNDS))
+
+
+@lru_cache(maxsize=1)
+def _passlib_context():
+    """Контекст passlib для обратной совместимости (создается один раз и только при необходимости)"""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -45,29 +107,42 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         # Проверяем пароль через bcrypt напрямую
         password_bytes = plain_password.encode('utf-8')
         hash_bytes = hashed_password.encode('utf-8')
-        return bcrypt.checkpw(password_bytes, hash_bytes)
+        return _checkpw(password_bytes, hash_bytes)
     except Exception:
         # Если не получилось через bcrypt, пробуем через passlib (для обратной совместимости)
         try:
-            from passlib.context import CryptContext
-            pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-            return pwd_context.verify(plain_password, hashed_password)
+            return _passlib_context().verify(plain_password, hashed_password)
         except Exception:
             return False
 
 
+def check_user_password(user: Optional[User], plain_password: str) -> bool:
+    """
+    Проверить пароль пользователя
+    
+    Для несуществующего пользователя bcrypt выполняется с фиктивным хешем, чтобы время
+    ответа не позволяло определить, существует ли учетная запись.
+    """
+    if user is None:
+        try:
+            _checkpw(plain_password.encode('utf-8'), _DUMMY_HASH)
+        except Exception:
+            # Как и verify_password: ошибка bcrypt (например, пароль длиннее 72 байт) - неверный пароль
+            pass
+        return False
+    return verify_password(plain_password, user.password_hash)
+
+
 def get_password_hash(password: str) -> str:
     """Получить хеш пароля"""
     try:
         # Используем bcrypt напрямую
         password_bytes = password.encode('utf-8')
-        salt = bcrypt.gensalt()
-        return bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+        salt = bcrypt.gensalt(rounds=_BCRYPT_ROUNDS)
+        return _hashpw(password_bytes, salt).decode('utf-8')
     except Exception:
         # Fallback на passlib если bcrypt не работает
-        from passlib.context import CryptContext
-        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-        return pwd_context.hash(password)
+        return _passlib_context().hash(password)
 
 
 def get_user_from_token(session_token: str, db: Session) -> Optional[User]:
@@ -83,12 +158,29 @@ def get_user_from_token(session_token: str, db: Session) -> Optional[User]:
     if username is None:
         return None
     
+    with _user_cache_lock:
+        cached_user = _user_cache.get(username)
+    if cached_user is not None:
+        return cached_user
+    
     user = db.query(User).filter(User.username == username).first()
     if user and not user.is_active:
         return None
     
+    if user:
+        # Отсоединяем объект от сессии, чтобы commit в обработчике не сбросил его атрибуты
+        db.expunge(user)
+        with _user_cache_lock:
+            _user_cache[username] = user
+    
     return user
 
+def invalidate_token(session_token: Optional[str]):
+    """Удалить токен из кэша (при выходе из системы)"""
+    if session_token:
+        with _jwt_cache_lock:
+            _jwt_cache.pop(hashlib.sha256(session_token.encode('utf-8')).digest(), None)
+
 def get_user_from_session(
     session_token: Optional[str] = Cookie(None, alias="session_token"),
     db: Session = Depends(get_db)
@@ -96,13 +188,39 @@ def get_user_from_session(
     """Получить пользователя из сессии"""
     return get_user_from_token(session_token, db) if session_token else None
 
+def _parse_basic_credentials(authorization: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Разобрать заголовок Authorization: Basic; None, если заголовка нет или схема другая"""
+    if not authorization:
+        return None
+    scheme, _, param = authorization.partition(" ")
+    if scheme.lower() != "basic":
+        return None
+    
+    try:
+        decoded = binascii.a2b_base64(param).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    
+    username, separator, password = decoded.partition(":")
+    if not separator:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return username, password
+
+
 def get_current_user(
     request: Request,
-    credentials: Optional[HTTPBasicCredentials] = Depends(HTTPBasic(auto_error=False)),
     db: Session = Depends(get_db)
 ) -> User:
     """Получить текущего пользователя из сессии или HTTP Basic Auth"""
-    # Сначала пробуем получить из сессии (cookie)
+    # Сначала пробуем получить из сессии (cookie); заголовок Authorization при этом не разбирается
     session_token = request.cookies.get("session_token")
     if session_token:
         user = get_user_from_token(session_token, db)
@@ -110,17 +228,18 @@ def get_current_user(
             return user
     
     # Если нет сессии, пробуем HTTP Basic Auth (для API)
+    credentials = _parse_basic_credentials(request.headers.get("authorization"))
     if credentials:
-        user = db.query(User).filter(User.username == credentials.username).first()
+        username, password = credentials
+        cache_key = (username, hashlib.sha256(password.encode('utf-8')).digest())
+        with _basic_auth_cache_lock:
+            cached_user = _basic_auth_cache.get(cache_key)
+        if cached_user is not None:
+            return cached_user
         
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Basic"},
-            )
+        user = db.query(User).filter(User.username == username).first()
         
-        if not verify_password(credentials.password, user.password_hash):
+        if not check_user_password(user, password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid authentication credentials",
@@ -133,6 +252,11 @@ def get_current_user(
                 detail="User is inactive"
             )
         
+        # Отсоединяем объект от сессии, чтобы commit в обработчике не сбросил его атрибуты
+        db.expunge(user)
+        with _basic_auth_cache_lock:
+            _basic_auth_cache[cache_key] = user
+        
         return user
     
     # Если нет ни сессии, ни Basic Auth - перенаправляем на страницу логина
@@ -155,7 +279,7 @@ def create_user(
         db = SessionLocal()
     
     # Проверяем, существует ли пользователь
-    if db.query(User).filter(User.username == username).first():
+    if db.scalar(select(exists().where(User.username == username))):
         raise ValueError("User already exists")
     
     user = User(
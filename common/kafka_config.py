@@ -82,7 +82,16 @@ class KafkaConfig:
         config = self.get_producer_config()
         config['group_id'] = self.consumer_group
         config['auto_offset_reset'] = 'earliest'
-        config['enable_auto_commit'] = True
+        # Смещения фиксирует сам Consumer после обработки каждой пачки сообщений
+        config['enable_auto_commit'] = False
+        # Увеличенный буфер сокета под крупные пачки сообщений
+        config['receive_buffer_bytes'] = 2 * 1024 * 1024
+        # Брокер отвечает, когда накопится 64 КБ или пройдет 250 мс: меньше пустых выборок,
+        # а poll() возвращает крупные пачки
+        config['fetch_min_bytes'] = 64 * 1024
+        config['fetch_max_wait_ms'] = 250
+        config['max_partition_fetch_bytes'] = 1024 * 1024
+        config['max_poll_records'] = 500
         return config
 
 
@@ -2,16 +2,57 @@
 Модуль сравнения конфигураций ПК
 """
 import logging
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
 
 from common.models import ChangeEvent
 from database import PCConfiguration as DBPCConfiguration
 
 
+class _ListSpec(NamedTuple):
+    """Описание множественного компонента (список модулей)"""
+    component_type: str
+    # Ключ элемента: (элемент, число уже учтенных элементов) -> ключ
+    key: Callable[[Dict[str, Any], int], Any]
+    # Тексты событий: (элемент, ключ) -> описание
+    removed: Callable[[Dict[str, Any], Any], str]
+    added: Callable[[Dict[str, Any], Any], str]
+    # None - замена элементов с одинаковым ключом не отслеживается
+    replaced: Optional[Callable[[Dict[str, Any], Any], str]]
+
+
 class ConfigComparator:
     """Класс для сравнения конфигураций ПК"""
     
+    __slots__ = ('logger',)
+    
+    # Множественные компоненты; остальные столбцы сравниваются как одиночные
+    _LIST_COMPONENTS = {
+        # RAM сопоставляется по серийному номеру или слоту
+        'ram_modules': _ListSpec(
+            component_type='ram',
+            key=lambda m, n: m.get('serial_number') or m.get('slot') or f"slot_{n}",
+            removed=lambda m, key: f"Модуль RAM удален: {m.get('model', 'неизвестно')} в слоте {m.get('slot', 'неизвестно')}",
+            added=lambda m, key: f"Модуль RAM добавлен: {m.get('model', 'неизвестно')} в слоте {m.get('slot', 'неизвестно')}",
+            replaced=lambda m, key: f"Модуль RAM заменен в слоте {m.get('slot', 'неизвестно')}",
+        ),
+        # Накопители сопоставляются по серийному номеру
+        'storage_devices': _ListSpec(
+            component_type='storage',
+            key=lambda d, n: d.get('serial_number') or f"device_{n}",
+            removed=lambda d, key: f"Накопитель удален: {d.get('model', 'неизвестно')}",
+            added=lambda d, key: f"Накопитель добавлен: {d.get('model', 'неизвестно')}",
+            replaced=lambda d, key: f"Накопитель заменен: {d.get('model', 'неизвестно')}",
+        ),
+        # Сетевые адаптеры сопоставляются по MAC-адресу
+        'network_adapters': _ListSpec(
+            component_type='network',
+            key=lambda a, n: a.get('mac_address'),
+            removed=lambda a, mac: f"Сетевой адаптер удален: {a.get('name', 'неизвестно')} ({mac})",
+            added=lambda a, mac: f"Сетевой адаптер добавлен: {a.get('name', 'неизвестно')} ({mac})",
+            replaced=None,
+        ),
+    }
+    
     def __init__(self):
         self.logger = logging.getLogger(__name__)
     
@@ -26,20 +67,25 @@ class ConfigComparator:
         Args:
             baseline: Эталонная конфигурация
             current: Текущая конфигурация
-            
+        
         Returns:
             Список событий изменений
         """
         events = []
         
-        # Сравниваем каждый компонент
-        events.extend(self._compare_component('motherboard', baseline, current))
-        events.extend(self._compare_component('cpu', baseline, current))
-        events.extend(self._compare_ram_modules(baseline, current))
-        events.extend(self._compare_storage_devices(baseline, current))
-        events.extend(self._compare_component('gpu', baseline, current))
-        events.extend(self._compare_network_adapters(baseline, current))
-        events.extend(self._compare_component('psu', baseline, current))
+        # Подробно сравниваем только компоненты с отличающимися хешами
+        changed = baseline.diff_components(current)
+        if not changed:
+            return events
+        
+        for component_name in DBPCConfiguration.COMPONENT_NAMES:
+            if component_name not in changed:
+                continue
+            spec = self._LIST_COMPONENTS.get(component_name)
+            if spec is None:
+                self._compare_component(component_name, baseline, current, events)
+            else:
+                self._compare_list(component_name, spec, baseline, current, events)
         
         return events
     
@@ -47,11 +93,10 @@ class ConfigComparator:
         self,
         component_name: str,
         baseline: DBPCConfiguration,
-        current: DBPCConfiguration
-    ) -> List[ChangeEvent]:
-        """Сравнить одиночный компонент"""
-        events = []
-        
+        current: DBPCConfiguration,
+        events: List[ChangeEvent]
+    ):
+        """Сравнить одиночный компонент, добавив события в events"""
         baseline_data = baseline.get_component(component_name)
         current_data = current.get_component(component_name)
         
@@ -88,175 +133,73 @@ class ConfigComparator:
                     new_value=current_data,
                     details=f"Компонент {component_name} заменен"
                 ))
-        
-        return events
     
-    def _compare_ram_modules(
-        self,
-        baseline: DBPCConfiguration,
-        current: DBPCConfiguration
-    ) -> List[ChangeEvent]:
-        """Сравнить модули RAM (могут быть множественные)"""
-        events = []
-        
-        baseline_modules = baseline.get_component('ram_modules') or []
-        current_modules = current.get_component('ram_modules') or []
-        
-        # Создаем словари по серийным номерам и слотам
-        baseline_dict = {}
-        for module in baseline_modules:
-            key = module.get('serial_number') or module.get('slot') or f"slot_{len(baseline_dict)}"
-            baseline_dict[key] = module
-        
-        current_dict = {}
-        for module in current_modules:
-            key = module.get('serial_number') or module.get('slot') or f"slot_{len(current_dict)}"
-            current_dict[key] = module
-        
-        # Проверяем удаленные модули
-        for key, module in baseline_dict.items():
-            if key not in current_dict:
-                events.append(ChangeEvent(
-                    pc_id=baseline.pc_id,
-                    component_type='ram',
-                    event_type='removed',
-                    old_value=module,
-                    new_value=None,
-                    details=f"Модуль RAM удален: {module.get('model', 'неизвестно')} в слоте {module.get('slot', 'неизвестно')}"
-                ))
-        
-        # Проверяем добавленные модули
-        for key, module in current_dict.items():
-            if key not in baseline_dict:
-                events.append(ChangeEvent(
-                    pc_id=baseline.pc_id,
-                    component_type='ram',
-                    event_type='added',
-                    old_value=None,
-                    new_value=module,
-                    details=f"Модуль RAM добавлен: {module.get('model', 'неизвестно')} в слоте {module.get('slot', 'неизвестно')}"
-                ))
-        
-        # Проверяем замененные модули
-        for key in baseline_dict.keys() & current_dict.keys():
-            if not self._components_equal(baseline_dict[key], current_dict[key]):
-                events.append(ChangeEvent(
-                    pc_id=baseline.pc_id,
-                    component_type='ram',
-                    event_type='replaced',
-                    old_value=baseline_dict[key],
-                    new_value=current_dict[key],
-                    details=f"Модуль RAM заменен в слоте {baseline_dict[key].get('slot', 'неизвестно')}"
-                ))
-        
-        return events
-    
-    def _compare_storage_devices(
+    def _compare_list(
         self,
+        component_name: str,
+        spec: _ListSpec,
         baseline: DBPCConfiguration,
-        current: DBPCConfiguration
-    ) -> List[ChangeEvent]:
-        """Сравнить накопители (могут быть множественные)"""
-        events = []
-        
-        baseline_devices = baseline.get_component('storage_devices') or []
-        current_devices = current.get_component('storage_devices') or []
-        
-        # Создаем словари по серийным номерам
+        current: DBPCConfiguration,
+        events: List[ChangeEvent]
+    ):
+        """Сравнить множественный компонент (RAM, накопители, сетевые адаптеры), добавив события в events"""
         baseline_dict = {}
-        for device in baseline_devices:
-            key = device.get('serial_number') or f"device_{len(baseline_dict)}"
-            baseline_dict[key] = device
+        for item in baseline.get_component(component_name) or []:
+            baseline_dict[spec.key(item, len(baseline_dict))] = item
         
         current_dict = {}
-        for device in current_devices:
-            key = device.get('serial_number') or f"device_{len(current_dict)}"
-            current_dict[key] = device
-        
-        # Проверяем удаленные устройства
-        for key, device in baseline_dict.items():
-            if key not in current_dict:
+        for item in current.get_component(component_name) or []:
+            current_dict[spec.key(item, len(current_dict))] = item
+        
+        # Один проход по объединению ключей: удаленные, добавленные и замененные элементы
+        for key in baseline_dict | current_dict:
+            old = baseline_dict.get(key)
+            new = current_dict.get(key)
+            if new is None:
                 events.append(ChangeEvent(
                     pc_id=baseline.pc_id,
-                    component_type='storage',
+                    component_type=spec.component_type,
                     event_type='removed',
-                    old_value=device,
+                    old_value=old,
                     new_value=None,
-                    details=f"Накопитель удален: {device.get('model', 'неизвестно')}"
+                    details=spec.removed(old, key)
                 ))
-        
-        # Проверяем добавленные устройства
-        for key, device in current_dict.items():
-            if key not in baseline_dict:
+            elif old is None:
                 events.append(ChangeEvent(
                     pc_id=baseline.pc_id,
-                    component_type='storage',
+                    component_type=spec.component_type,
                     event_type='added',
                     old_value=None,
-                    new_value=device,
-                    details=f"Накопитель добавлен: {device.get('model', 'неизвестно')}"
+                    new_value=new,
+                    details=spec.added(new, key)
                 ))
-        
-        # Проверяем замененные устройства
-        for key in baseline_dict.keys() & current_dict.keys():
-            if not self._components_equal(baseline_dict[key], current_dict[key]):
+            elif spec.replaced is not None and not self._components_equal(old, new):
                 events.append(ChangeEvent(
                     pc_id=baseline.pc_id,
-                    component_type='storage',
+                    component_type=spec.component_type,
                     event_type='replaced',
-                    old_value=baseline_dict[key],
-                    new_value=current_dict[key],
-                    details=f"Накопитель заменен: {baseline_dict[key].get('model', 'неизвестно')}"
+                    old_value=old,
+                    new_value=new,
+                    details=spec.replaced(old, key)
                 ))
-        
-        return events
-    
-    def _compare_network_adapters(
-        self,
-        baseline: DBPCConfiguration,
-        current: DBPCConfiguration
-    ) -> List[ChangeEvent]:
-        """Сравнить сетевые адаптеры (могут быть множественные)"""
-        events = []
-        
-        baseline_adapters = baseline.get_component('network_adapters') or []
-        current_adapters = current.get_component('network_adapters') or []
-        
-        # Создаем словари по MAC-адресам
-        baseline_dict = {adapter.get('mac_address'): adapter for adapter in baseline_adapters}
-        current_dict = {adapter.get('mac_address'): adapter for adapter in current_adapters}
-        
-        # Проверяем удаленные адаптеры
-        for mac, adapter in baseline_dict.items():
-            if mac not in current_dict:
-                events.append(ChangeEvent(
-                    pc_id=baseline.pc_id,
-                    component_type='network',
-                    event_type='removed',
-                    old_value=adapter,
-                    new_value=None,
-                    details=f"Сетевой адаптер удален: {adapter.get('name', 'неизвестно')} ({mac})"
-                ))
-        
-        # Проверяем добавленные адаптеры
-        for mac, adapter in current_dict.items():
-            if mac not in baseline_dict:
-                events.append(ChangeEvent(
-                    pc_id=baseline.pc_id,
-                    component_type='network',
-                    event_type='added',
-                    old_value=None,
-                    new_value=adapter,
-                    details=f"Сетевой адаптер добавлен: {adapter.get('name', 'неизвестно')} ({mac})"
-                ))
-        
-        return events
     
     def _components_equal(self, comp1: Dict[str, Any], comp2: Dict[str, Any]) -> bool:
         """Проверить, равны ли два компонента"""
-        # Нормализуем словари (убираем None значения для сравнения)
-        def normalize(d):
-            return {k: v for k, v in d.items() if v is not None}
-        
-        return normalize(comp1) == normalize(comp2)
+        # Обычно неизмененные элементы совпадают целиком, нормализация не нужна
+        if comp1 == comp2:
+            return True
+        return _normalize(comp1) == _normalize(comp2)
+
+
+def _hashable(value: Any) -> Any:
+    """Привести значение к хешируемому виду (вложенные списки и словари)"""
+    if isinstance(value, dict):
+        return frozenset((k, _hashable(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    return value
+
 
+def _normalize(d: Dict[str, Any]) -> frozenset:
+    """Нормализовать компонент для сравнения (None значения не учитываются)"""
+    return frozenset((k, _hashable(v)) for k, v in d.items() if v is not None)
@@ -1,21 +1,96 @@
 """
 Модели базы данных для системы PC-Guardian
 """
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import create_engine, event, Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Index
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 from typing import Optional, Dict, Any
-import json
+import hashlib
+import orjson
 import os
 
 # Создаем базовый класс для моделей
 Base = declarative_base()
 
+
+class EncodedJSON(str):
+    """Уже сериализованное JSON-значение: JSONText записывает его в БД без повторного dumps"""
+    __slots__ = ()
+
+
+class JSONText(TypeDecorator):
+    """
+    JSON, хранящийся в текстовом столбце
+    
+    Значение разбирается один раз при загрузке строки из БД и сериализуется при записи,
+    поэтому атрибуты модели содержат уже готовые dict/list. Схема остается TEXT,
+    так что существующие базы не требуют миграции.
+    """
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, EncodedJSON):
+            return str(value)
+        return orjson.dumps(value).decode()
+    
+    def process_result_value(self, value, dialect):
+        return orjson.loads(value) if value is not None else None
+
 # Настройка подключения к БД
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///pc_guardian.db')
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if 'sqlite' in DATABASE_URL else {})
+
+if 'sqlite' in DATABASE_URL:
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    # Отдельный engine для consumer Kafka: его транзакции сразу берут блокировку записи
+    consumer_engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL позволяет читать параллельно с записью; NORMAL безопасен в режиме WAL"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+    
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(consumer_engine, "connect", _set_sqlite_pragmas)
+    
+    @event.listens_for(consumer_engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        # Транзакции consumer начинает SQLAlchemy (см. _begin_consumer_transaction), иначе pysqlite
+        # не открывает транзакцию перед SAVEPOINT и begin_nested() фиксирует данные сразу
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(consumer_engine, "begin")
+    def _begin_consumer_transaction(connection):
+        # IMMEDIATE: блокировка записи берется в начале (с ожиданием по timeout соединения).
+        # Транзакция, начатая с чтения, иначе получает "database is locked" при первой записи,
+        # если другое соединение успело зафиксировать изменения
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+else:
+    # Пул рассчитан на пул потоков обработчиков FastAPI (THREAD_POOL_SIZE) и consumer Kafka
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=int(os.getenv('DB_POOL_SIZE', '20')),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '40')),
+        pool_pre_ping=True,
+        pool_recycle=1800
+    )
+    consumer_engine = engine
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Сессии consumer Kafka (в SQLite - через consumer_engine с BEGIN IMMEDIATE)
+ConsumerSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=consumer_engine)
+
+
+def _iso(dt: Optional[datetime]) -> Optional[str]:
+    """Дата в формате ISO 8601 с точностью до секунд"""
+    return dt.isoformat(timespec='seconds') if dt else None
+
 
 def get_db():
     """Получить сессию БД"""
@@ -44,7 +119,7 @@ class Room(Base):
             'id': self.id,
             'name': self.name,
             'description': self.description,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': _iso(self.created_at)
         }
 
 
@@ -68,7 +143,7 @@ class Camera(Base):
             'status': self.status,
             'device_id': self.device_id,
             'ip_address': self.ip_address,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': _iso(self.created_at)
         }
 
 
@@ -81,7 +156,7 @@ class PC(Base):
     hostname = Column(String(255), nullable=False)
     room_id = Column(Integer, ForeignKey('rooms.id'), nullable=True, index=True)
     registered_at = Column(DateTime, default=datetime.utcnow)
-    last_seen = Column(DateTime, nullable=True)
+    last_seen = Column(DateTime, nullable=True, index=True)
     status = Column(String(50), default='unknown')  # unknown, normal, changed, offline
     
     # Связи
@@ -94,13 +169,89 @@ class PC(Base):
             'pc_id': self.pc_id,
             'hostname': self.hostname,
             'room_id': self.room_id,
-            'registered_at': self.registered_at.isoformat() if self.registered_at else None,
-            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'registered_at': _iso(self.registered_at),
+            'last_seen': _iso(self.last_seen),
             'status': self.status
         }
 
 
-class PCConfiguration(Base):
+def _canonical_json(data: Any) -> bytes:
+    """Каноническая форма компонента (ключи отсортированы)"""
+    return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+
+
+class ComponentDigestMixin:
+    """Хеши компонентов конфигурации для быстрого сравнения (требует get_component)"""
+    
+    # Имена столбцов с компонентами
+    COMPONENT_NAMES = ('motherboard', 'cpu', 'ram_modules', 'storage_devices', 'gpu', 'network_adapters', 'psu')
+    
+    # Хеши компонентов, вычисленные для этого экземпляра (не хранятся в БД)
+    _digest_cache = None
+    
+    def get_component_digest(self, component_name: str) -> Optional[bytes]:
+        """Получить хеш канонической формы компонента (None, если компонента нет)"""
+        if self._digest_cache is None:
+            self._digest_cache = {}
+        try:
+            return self._digest_cache[component_name]
+        except KeyError:
+            pass
+        
+        data = self.get_component(component_name)
+        digest = None
+        if data is not None:
+            digest = hashlib.blake2b(_canonical_json(data), digest_size=16).digest()
+        self._digest_cache[component_name] = digest
+        return digest
+    
+    def encode_components(self) -> Dict[str, Optional[EncodedJSON]]:
+        """
+        Сериализовать компоненты для записи в БД
+        
+        Каноническая форма сериализуется один раз и используется и для хеша, и для INSERT.
+        """
+        if self._digest_cache is None:
+            self._digest_cache = {}
+        encoded = {}
+        for name in self.COMPONENT_NAMES:
+            data = self.get_component(name)
+            if data is None:
+                self._digest_cache[name] = None
+                encoded[name] = None
+                continue
+            canonical = _canonical_json(data)
+            self._digest_cache[name] = hashlib.blake2b(canonical, digest_size=16).digest()
+            encoded[name] = EncodedJSON(canonical.decode())
+        return encoded
+    
+    def diff_components(self, other: 'ComponentDigestMixin') -> set:
+        """Получить имена компонентов, хеши которых отличаются от другой конфигурации"""
+        return {
+            name for name in self.COMPONENT_NAMES
+            if self.get_component_digest(name) != other.get_component_digest(name)
+        }
+
+
+class ConfigurationSnapshot(ComponentDigestMixin):
+    """
+    Снимок компонентов сохраненной конфигурации, прочитанный без ORM
+    
+    Строки конфигураций не изменяются после записи, поэтому снимок (вместе с вычисленными
+    хешами) можно переиспользовать, пока id эталонной конфигурации ПК не изменился.
+    """
+    
+    def __init__(self, id: int, pc_id: str, components: Dict[str, Any]):
+        self.id = id
+        self.pc_id = pc_id
+        self._components = {name: components[name] for name in self.COMPONENT_NAMES}
+    
+    def get_component(self, component_name: str) -> Optional[Dict[str, Any]]:
+        """Получить компонент"""
+        return self._components.get(component_name) or None
+
+
+class PCConfiguration(ComponentDigestMixin, Base):
     """Модель конфигурации ПК"""
     __tablename__ = 'pc_configurations'
     
@@ -110,25 +261,23 @@ class PCConfiguration(Base):
     timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Компоненты (хранятся как JSON)
-    motherboard = Column(Text, nullable=True)
-    cpu = Column(Text, nullable=True)
-    ram_modules = Column(Text, nullable=True)
-    storage_devices = Column(Text, nullable=True)
-    gpu = Column(Text, nullable=True)
-    network_adapters = Column(Text, nullable=True)
-    psu = Column(Text, nullable=True)
+    motherboard = Column(JSONText, nullable=True)
+    cpu = Column(JSONText, nullable=True)
+    ram_modules = Column(JSONText, nullable=True)
+    storage_devices = Column(JSONText, nullable=True)
+    gpu = Column(JSONText, nullable=True)
+    network_adapters = Column(JSONText, nullable=True)
+    psu = Column(JSONText, nullable=True)
     
     def set_component(self, component_name: str, data: Optional[Dict[str, Any]]):
         """Установить компонент"""
-        json_data = json.dumps(data, ensure_ascii=False) if data else None
-        setattr(self, component_name, json_data)
+        setattr(self, component_name, data if data else None)
+        if self._digest_cache is not None:
+            self._digest_cache.pop(component_name, None)
     
     def get_component(self, component_name: str) -> Optional[Dict[str, Any]]:
         """Получить компонент"""
-        json_data = getattr(self, component_name)
-        if json_data:
-            return json.loads(json_data)
-        return None
+        return getattr(self, component_name) or None
     
     def to_dict(self) -> Dict[str, Any]:
         """Преобразовать в словарь"""
@@ -136,10 +285,10 @@ class PCConfiguration(Base):
             'id': self.id,
             'pc_id': self.pc_id,
             'is_baseline': self.is_baseline,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'timestamp': _iso(self.timestamp),
         }
         
-        for component in ['motherboard', 'cpu', 'ram_modules', 'storage_devices', 'gpu', 'network_adapters', 'psu']:
+        for component in self.COMPONENT_NAMES:
             result[component] = self.get_component(component)
         
         return result
@@ -157,8 +306,8 @@ class ChangeEvent(Base):
     details = Column(Text, nullable=True)
     
     # Старое и новое значение (хранятся как JSON)
-    old_value = Column(Text, nullable=True)
-    new_value = Column(Text, nullable=True)
+    old_value = Column(JSONText, nullable=True)
+    new_value = Column(JSONText, nullable=True)
     
     # Статус уведомления
     notified = Column(Boolean, default=False)
@@ -171,23 +320,19 @@ class ChangeEvent(Base):
     
     def set_old_value(self, value: Optional[Dict[str, Any]]):
         """Установить старое значение"""
-        self.old_value = json.dumps(value, ensure_ascii=False) if value else None
+        self.old_value = value if value else None
     
     def set_new_value(self, value: Optional[Dict[str, Any]]):
         """Установить новое значение"""
-        self.new_value = json.dumps(value, ensure_ascii=False) if value else None
+        self.new_value = value if value else None
     
     def get_old_value(self) -> Optional[Dict[str, Any]]:
         """Получить старое значение"""
-        if self.old_value:
-            return json.loads(self.old_value)
-        return None
+        return self.old_value or None
     
     def get_new_value(self) -> Optional[Dict[str, Any]]:
         """Получить новое значение"""
-        if self.new_value:
-            return json.loads(self.new_value)
-        return None
+        return self.new_value or None
     
     def to_dict(self) -> Dict[str, Any]:
         """Преобразовать в словарь"""
@@ -196,25 +341,45 @@ class ChangeEvent(Base):
             'pc_id': self.pc_id,
             'component_type': self.component_type,
             'event_type': self.event_type,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'timestamp': _iso(self.timestamp),
             'details': self.details,
             'old_value': self.get_old_value(),
             'new_value': self.get_new_value(),
             'notified': self.notified,
-            'notified_at': self.notified_at.isoformat() if self.notified_at else None,
+            'notified_at': _iso(self.notified_at),
             'video_recorded': self.video_recorded,
             'video_path': self.video_path,
-            'video_recorded_at': self.video_recorded_at.isoformat() if self.video_recorded_at else None
+            'video_recorded_at': _iso(self.video_recorded_at)
         }
 
 
+# Составные индексы под частые фильтры с сортировкой по времени (ORDER BY timestamp DESC LIMIT)
+Index('ix_events_pc_ts', ChangeEvent.pc_id, ChangeEvent.timestamp.desc())
+Index('ix_events_ctype_ts', ChangeEvent.component_type, ChangeEvent.timestamp.desc())
+# id включен в индекс, чтобы подзапросы выбора эталонной/последней конфигурации в Postgres читали только индекс
+Index(
+    'ix_cfg_pc_baseline_ts',
+    PCConfiguration.pc_id, PCConfiguration.is_baseline, PCConfiguration.timestamp.desc(),
+    postgresql_include=['id']
+)
+# Частичный индекс только по эталонным строкам: поиск эталона ПК при каждом сообщении
+# не зависит от объема накопленной истории конфигураций
+Index(
+    'ix_pcconfig_pc_baseline',
+    PCConfiguration.pc_id,
+    postgresql_where=PCConfiguration.is_baseline == True,
+    postgresql_include=['id'],
+    sqlite_where=PCConfiguration.is_baseline == True
+)
+
+
 class User(Base):
     """Модель пользователя для веб-интерфейса"""
     __tablename__ = 'users'
     
     id = Column(Integer, primary_key=True)
-    username = Column(String(80), unique=True, nullable=False)
-    email = Column(String(120), unique=True, nullable=False)
+    username = Column(String(80), unique=True, index=True, nullable=False)
+    email = Column(String(120), unique=True, index=True, nullable=False)
     password_hash = Column(String(255), nullable=False)
     role = Column(String(50), default='viewer')  # admin, viewer
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -226,7 +391,7 @@ class User(Base):
             'username': self.username,
             'email': self.email,
             'role': self.role,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'created_at': _iso(self.created_at),
             'is_active': self.is_active
         }
 
@@ -1,14 +1,12 @@
 """
 Скрипт инициализации базы данных
 """
-import bcrypt
-from database import Base, engine, SessionLocal, User
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select, exists
 
-def get_password_hash(password: str) -> str:
-    """Получить хеш пароля через bcrypt"""
-    password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+from database import Base, engine, SessionLocal, User
+from auth import get_password_hash
 
 def init_db():
     """Инициализировать базу данных"""
@@ -18,24 +16,26 @@ def init_db():
     db = SessionLocal()
     try:
         # Проверяем, есть ли уже пользователи
-        if db.query(User).count() == 0:
-            # Создаем администратора по умолчанию
-            admin = User(
-                username="admin",
-                email="admin@pc-guardian.local",
-                password_hash=get_password_hash("admin"),
-                role="admin"
-            )
-            db.add(admin)
+        if not db.scalar(select(exists().select_from(User))):
+            # Хешируем пароли параллельно: bcrypt освобождает GIL
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                admin_hash, viewer_hash = executor.map(get_password_hash, ["admin", "viewer"])
             
-            # Создаем пользователя для просмотра
-            viewer = User(
-                username="viewer",
-                email="viewer@pc-guardian.local",
-                password_hash=get_password_hash("viewer"),
-                role="viewer"
-            )
-            db.add(viewer)
+            # Создаем администратора и пользователя для просмотра одной вставкой
+            db.bulk_save_objects([
+                User(
+                    username="admin",
+                    email="admin@pc-guardian.local",
+                    password_hash=admin_hash,
+                    role="admin"
+                ),
+                User(
+                    username="viewer",
+                    email="viewer@pc-guardian.local",
+                    password_hash=viewer_hash,
+                    role="viewer"
+                ),
+            ])
             
             db.commit()
             print("Созданы пользователи по умолчанию:")
@@ -1,24 +1,100 @@
 """
 Kafka Consumer для получения данных от агентов
 """
-import json
+import io
 import logging
+import os
 import threading
-from typing import Optional
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional, Tuple
+import orjson
 from kafka import KafkaConsumer
 from kafka.errors import KafkaError
+from sqlalchemy import bindparam, insert, select, text
+from sqlalchemy.orm import Session
 
 from datetime import datetime
 from common.kafka_config import KafkaConfig
 from common.models import PCConfiguration
-from database import SessionLocal, PC, PCConfiguration as DBPCConfiguration, ChangeEvent, Base, engine
+from database import (
+    ConsumerSessionLocal, PC, PCConfiguration as DBPCConfiguration, ConfigurationSnapshot, ChangeEvent, EncodedJSON,
+    Base, engine
+)
 from config_comparator import ConfigComparator
 from notifications import NotificationService
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+# Настройка логирования (один раз на процесс и только если приложение не настроило его само)
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+# Сообщения больше этого размера (байт) разбираются потоково через ijson, если он установлен
+STREAM_PARSE_THRESHOLD = 64 * 1024
+
+# Ключи верхнего уровня, которые читает PCConfiguration.from_dict
+_PAYLOAD_KEYS = frozenset((
+    'pc_id', 'hostname', 'timestamp', 'motherboard', 'cpu', 'ram_modules',
+    'storage_devices', 'gpu', 'network_adapters', 'psu'
+))
+
+
+def _deserialize_message(raw: bytes) -> dict:
+    """
+    Разобрать JSON-сообщение агента
+    
+    Небольшие сообщения разбирает orjson. Крупные инвентаризации разбираются ijson
+    по ключам верхнего уровня: неиспользуемые ключи не сохраняются в результате.
+    """
+    if ijson is None or len(raw) <= STREAM_PARSE_THRESHOLD:
+        # orjson разбирает байты напрямую, без промежуточного decode()
+        return orjson.loads(raw)
+    # use_float: числа как float, а не Decimal (Decimal не сериализуется в JSON-столбцы)
+    return {
+        key: value
+        for key, value in ijson.kvitems(io.BytesIO(raw), '', use_float=True)
+        if key in _PAYLOAD_KEYS
+    }
+
+
+# Скомпилированные один раз запросы эталонной конфигурации (Core, без создания ORM-объектов)
+_BASELINE_ID_STMT = select(DBPCConfiguration.id).where(
+    DBPCConfiguration.pc_id == bindparam('pc_id'),
+    DBPCConfiguration.is_baseline == True
+).limit(1)
+
+_BASELINE_COMPONENTS_STMT = select(
+    *(DBPCConfiguration.__table__.c[name] for name in DBPCConfiguration.COMPONENT_NAMES)
+).where(DBPCConfiguration.id == bindparam('id'))
+
 
 class PCGuardianConsumer:
     """Kafka Consumer для обработки конфигураций ПК"""
     
+    # Максимальное количество сообщений, получаемых за один poll()
+    POLL_BATCH_SIZE = 500
+    
+    # Пауза (сек) перед повторной обработкой пачки, которую не удалось записать в БД
+    RETRY_DELAY = 1
+    
+    # PostgreSQL: не ждать сброса WAL на диск при commit пачки. При сбое сервера БД теряются
+    # только последние транзакции; агенты присылают полную конфигурацию повторно
+    ASYNC_COMMIT = os.getenv('DB_ASYNC_COMMIT', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Потоки, параллельно обрабатывающие пачку. В SQLite одновременно пишет только одна
+    # транзакция, поэтому там пачка всегда обрабатывается в потоке consumer
+    WORKERS = 1 if engine.dialect.name == 'sqlite' else int(
+        os.getenv('KAFKA_CONSUMER_WORKERS', str(min(4, os.cpu_count() or 1)))
+    )
+    
     def __init__(self, kafka_config: Optional[KafkaConfig] = None):
         """
         Инициализация Consumer
@@ -30,13 +106,13 @@ class PCGuardianConsumer:
         self.consumer = None
         self.running = False
         self.comparator = ConfigComparator()
+        # Кэш pc_id -> первичный ключ ПК; записи проверяются при чтении
+        self._pc_cache: Dict[str, int] = {}
+        # Кэш pc_id -> снимок компонентов эталонной конфигурации (с вычисленными хешами)
+        self._baseline_cache: Dict[str, ConfigurationSnapshot] = {}
         self.notification_service = NotificationService()
-        
-        # Настройка логирования
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        # Пул для параллельной обработки частей пачки (кэши выше разделены по pc_id между частями)
+        self._pool = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix="config-worker") if self.WORKERS > 1 else None
         self.logger = logging.getLogger(__name__)
     
     def _create_consumer(self):
@@ -46,134 +122,231 @@ class PCGuardianConsumer:
             self.consumer = KafkaConsumer(
                 self.kafka_config.topic,
                 **config,
-                value_deserializer=lambda m: json.loads(m.decode('utf-8')),
-                consumer_timeout_ms=1000
+                value_deserializer=_deserialize_message
             )
             self.logger.info("Kafka Consumer создан успешно")
         except Exception as e:
-            self.logger.error(f"Ошибка создания Kafka Consumer: {e}")
+            self.logger.error("Ошибка создания Kafka Consumer: %s", e)
             raise
     
-    def _process_configuration(self, config_data: dict):
-        """Обработать полученную конфигурацию"""
-        db = SessionLocal()
+    def _process_batch(self, batch: list):
+        """
+        Обработать пачку конфигураций, полученных за один poll()
+        
+        Пачка делится на части по pc_id: сообщения одного ПК всегда попадают в одну часть
+        и обрабатываются по порядку, а разные части - параллельно в пуле потоков.
+        Метод возвращается, когда все части зафиксированы, поэтому смещения Kafka
+        по-прежнему фиксируются после записи всей пачки. Ошибка записи любой части
+        пробрасывается после завершения остальных.
+        """
+        if self._pool is None or len(batch) < 2:
+            self._process_shard(batch)
+            return
+        
+        shards = [[] for _ in range(self.WORKERS)]
+        for config_data in batch:
+            # Некорректное сообщение (JSON не объект) попадает в любую часть и будет пропущено там
+            pc_id = config_data.get('pc_id') if isinstance(config_data, dict) else None
+            shards[hash(pc_id) % self.WORKERS].append(config_data)
+        futures = [self._pool.submit(self._process_shard, shard) for shard in shards if shard]
+        # Дожидаемся всех частей, прежде чем сообщить об ошибке: иначе повторно прочитанная
+        # пачка обрабатывалась бы параллельно с еще работающими частями
+        wait(futures)
+        for future in futures:
+            future.result()
+    
+    def _process_shard(self, batch: list):
+        """
+        Обработать сообщения в одной транзакции (своя сессия на каждый поток)
+        
+        Каждое сообщение обрабатывается в своей точке сохранения (SAVEPOINT): ошибка
+        откатывает только это сообщение, остальные фиксируются общим commit.
+        Ошибка самой транзакции (например, commit) пробрасывается, чтобы смещения Kafka
+        не были зафиксированы и пачка была прочитана повторно.
+        """
+        db = ConsumerSessionLocal()
+        # Уведомления отправляются после commit, чтобы сетевые вызовы не удерживали транзакцию
+        alerts = []
         try:
-            # Парсим конфигурацию
-            config = PCConfiguration.from_dict(config_data)
+            if self.ASYNC_COMMIT and engine.dialect.name == 'postgresql':
+                # Действует только в этой транзакции; API и авторизация фиксируются как обычно
+                db.execute(text("SET LOCAL synchronous_commit = OFF"))
             
-            # Проверяем, существует ли ПК
-            pc = db.query(PC).filter_by(pc_id=config.pc_id).first()
+            for config_data in batch:
+                try:
+                    with db.begin_nested():
+                        message_alerts = self._process_configuration(db, config_data)
+                    alerts.extend(message_alerts)
+                except Exception as e:
+                    self.logger.error("Ошибка обработки конфигурации: %s", e, exc_info=True)
             
-            last_seen_time = config.timestamp if config.timestamp else datetime.utcnow()
+            db.commit()
             
-            if not pc:
-                # Регистрируем новый ПК
-                # TODO: Привязку к аудитории можно будет извлекать из доменного имени устройства (hostname).
-                #       Иногда доменное имя формируют с привязкой к аудитории, но формат доменного имени уточнить.
-                #       Здесь можно будет добавить логику парсинга hostname и автоматического определения room_id.
-                pc = PC(
-                    pc_id=config.pc_id,
-                    hostname=config.hostname,
-                    status='normal',
-                    last_seen=last_seen_time
-                    # room_id можно будет определить автоматически из hostname
-                )
-                db.add(pc)
-                db.flush()
-                
-                baseline = self._create_db_configuration(pc.pc_id, config, is_baseline=True)
-                db.add(baseline)
-                
-                current_config = self._create_db_configuration(pc.pc_id, config, is_baseline=False)
-                db.add(current_config)
-                
-                self.logger.info(f"Зарегистрирован новый ПК: {config.pc_id} ({config.hostname})")
-            else:
-                pc.last_seen = last_seen_time
-                
-                # TODO: При обновлении ПК можно проверять, изменился ли hostname, и если изменился
-                #       или room_id не установлен, попытаться извлечь room_id из доменного имени.
-                #       Это поможет автоматически привязывать ПК к аудиториям на основе доменного имени.
-                
-                baseline = db.query(DBPCConfiguration).filter_by(
-                    pc_id=pc.pc_id,
-                    is_baseline=True
-                ).first()
+        except Exception:
+            db.close()
+            # Кэши могли запомнить строки, созданные в откаченной транзакции
+            for config_data in batch:
+                if isinstance(config_data, dict):
+                    self._pc_cache.pop(config_data.get('pc_id'), None)
+                    self._baseline_cache.pop(config_data.get('pc_id'), None)
+            raise
+        
+        try:
+            for pc, event in alerts:
+                self.notification_service.send_alert(pc, event)
+        except Exception as e:
+            # Данные уже зафиксированы: повторная обработка пачки продублировала бы события
+            self.logger.error("Ошибка отправки уведомлений: %s", e, exc_info=True)
+        finally:
+            db.close()
+    
+    def _process_configuration(self, db: Session, config_data: dict) -> list:
+        """
+        Обработать полученную конфигурацию в сессии db (без commit)
+        
+        Returns:
+            Пары (ПК, событие) для отправки уведомлений после фиксации транзакции
+        """
+        alerts = []
+        
+        # Парсим конфигурацию
+        config = PCConfiguration.from_dict(config_data)
+        
+        # Проверяем, существует ли ПК
+        pc, baseline = self._lookup_pc(db, config.pc_id)
+        
+        # Одна отметка времени на сообщение: для last_seen и создаваемых конфигураций
+        last_seen_time = config.timestamp if config.timestamp else datetime.utcnow()
+        # Снимок текущей конфигурации: компоненты сериализуются один раз - для хешей и для INSERT
+        current = ConfigurationSnapshot(None, config.pc_id, self._extract_components(config))
+        encoded = current.encode_components()
+        
+        if not pc:
+            # Регистрируем новый ПК
+            # TODO: Привязку к аудитории можно будет извлекать из доменного имени устройства (hostname).
+            #       Иногда доменное имя формируют с привязкой к аудитории, но формат доменного имени уточнить.
+            #       Здесь можно будет добавить логику парсинга hostname и автоматического определения room_id.
+            pc = PC(
+                pc_id=config.pc_id,
+                hostname=config.hostname,
+                status='normal',
+                last_seen=last_seen_time
+                # room_id можно будет определить автоматически из hostname
+            )
+            db.add(pc)
+            db.flush()
+            
+            self._insert_configurations(db, pc.pc_id, encoded, last_seen_time, with_baseline=True)
+            
+            self.logger.info("Зарегистрирован новый ПК: %s (%s)", config.pc_id, config.hostname)
+        else:
+            pc.last_seen = last_seen_time
+            
+            # TODO: При обновлении ПК можно проверять, изменился ли hostname, и если изменился
+            #       или room_id не установлен, попытаться извлечь room_id из доменного имени.
+            #       Это поможет автоматически привязывать ПК к аудиториям на основе доменного имени.
+            
+            if baseline:
+                # Сравниваем словари компонентов, ORM-объект текущей конфигурации не создается
+                events = self.comparator.compare_configurations(baseline, current)
                 
-                if baseline:
-                    current_db_config = self._create_db_configuration(pc.pc_id, config, is_baseline=False)
-                    events = self.comparator.compare_configurations(baseline, current_db_config)
+                if events:
+                    pc.status = 'changed'
                     
-                    if events:
-                        pc.status = 'changed'
-                        
-                        for event in events:
-                            db_event = ChangeEvent(
-                                pc_id=pc.pc_id,
-                                component_type=event.component_type,
-                                event_type=event.event_type,
-                                timestamp=event.timestamp,
-                                details=event.details
-                            )
-                            db_event.set_old_value(event.old_value)
-                            db_event.set_new_value(event.new_value)
-                            db.add(db_event)
-                            
-                            self.notification_service.send_alert(pc, event)
-                            
-                            # TODO: При обнаружении изменений конфигурации ПК, если в аудитории установлены камеры,
-                            #       здесь можно будет добавить логику для инициации видеофиксации
-                        
-                        self.logger.warning(
-                            f"Обнаружены изменения на ПК {config.pc_id}: {len(events)} событий"
-                        )
-                    else:
-                        pc.status = 'normal'
+                    # События вставляются одним executemany, без учета каждого объекта в unit of work
+                    db.execute(insert(ChangeEvent), [
+                        {
+                            'pc_id': pc.pc_id,
+                            'component_type': event.component_type,
+                            'event_type': event.event_type,
+                            'timestamp': event.timestamp,
+                            'details': event.details,
+                            'old_value': event.old_value or None,
+                            'new_value': event.new_value or None,
+                        }
+                        for event in events
+                    ])
+                    alerts.extend((pc, event) for event in events)
                     
-                    db.add(current_db_config)
-                else:
-                    baseline = self._create_db_configuration(pc.pc_id, config, is_baseline=True)
-                    db.add(baseline)
-                    
-                    current_config = self._create_db_configuration(pc.pc_id, config, is_baseline=False)
-                    db.add(current_config)
+                    # TODO: При обнаружении изменений конфигурации ПК, если в аудитории установлены камеры,
+                    #       здесь можно будет добавить логику для инициации видеофиксации
                     
+                    self.logger.warning(
+                        "Обнаружены изменения на ПК %s: %d событий", config.pc_id, len(events)
+                    )
+                else:
                     pc.status = 'normal'
-                    pc.last_seen = last_seen_time
-                    self.logger.info(f"Создана эталонная конфигурация для ПК: {config.pc_id}")
-            
-            db.commit()
-            
-        except Exception as e:
-            self.logger.error(f"Ошибка обработки конфигурации: {e}", exc_info=True)
-            db.rollback()
-        finally:
-            db.close()
+                
+                self._insert_configurations(db, pc.pc_id, encoded, last_seen_time, with_baseline=False)
+            else:
+                self._insert_configurations(db, pc.pc_id, encoded, last_seen_time, with_baseline=True)
+                
+                pc.status = 'normal'
+                pc.last_seen = last_seen_time
+                self.logger.info("Создана эталонная конфигурация для ПК: %s", config.pc_id)
+        
+        return alerts
+    
+    def _lookup_pc(self, db: Session, pc_id: str) -> Tuple[Optional[PC], Optional[ConfigurationSnapshot]]:
+        """
+        Найти ПК и снимок его эталонной конфигурации
+        
+        ПК загружается по первичному ключу из _pc_cache; устаревшая запись приводит
+        к обычному поиску по pc_id.
+        Для эталона каждый раз читается только его id, а компоненты берутся из _baseline_cache,
+        пока id не изменился (например, после смены эталона через API).
+        """
+        pc = None
+        pc_pk = self._pc_cache.get(pc_id)
+        if pc_pk is not None:
+            pc = db.get(PC, pc_pk)
+            if pc is None or pc.pc_id != pc_id:
+                pc = None
+                self._pc_cache.pop(pc_id, None)
+        
+        if pc is None:
+            pc = db.query(PC).filter_by(pc_id=pc_id).first()
+            if not pc:
+                return None, None
+            self._pc_cache[pc_id] = pc.id
+        
+        baseline_id = db.execute(_BASELINE_ID_STMT, {'pc_id': pc_id}).scalar()
+        if baseline_id is None:
+            self._baseline_cache.pop(pc_id, None)
+            return pc, None
+        
+        baseline = self._baseline_cache.get(pc_id)
+        if baseline is None or baseline.id != baseline_id:
+            row = db.execute(_BASELINE_COMPONENTS_STMT, {'id': baseline_id}).one()
+            baseline = ConfigurationSnapshot(baseline_id, pc_id, row._mapping)
+            self._baseline_cache[pc_id] = baseline
+        return pc, baseline
+    
+    def _extract_components(self, config: PCConfiguration) -> Dict[str, Any]:
+        """Получить компоненты конфигурации в том виде, в котором они хранятся в БД"""
+        return {
+            'motherboard': config.motherboard.to_dict() if config.motherboard else None,
+            'cpu': config.cpu.to_dict() if config.cpu else None,
+            'ram_modules': [m.to_dict() for m in config.ram_modules] if config.ram_modules else None,
+            'storage_devices': [s.to_dict() for s in config.storage_devices] if config.storage_devices else None,
+            'gpu': config.gpu.to_dict() if config.gpu else None,
+            'network_adapters': [n.to_dict() for n in config.network_adapters] if config.network_adapters else None,
+            'psu': config.psu.to_dict() if config.psu else None,
+        }
     
-    def _create_db_configuration(self, pc_id: str, config: PCConfiguration, is_baseline: bool) -> DBPCConfiguration:
-        """Создать объект конфигурации для БД"""
-        db_config = DBPCConfiguration(
-            pc_id=pc_id,
-            is_baseline=is_baseline,
-            timestamp=config.timestamp if config.timestamp else datetime.utcnow()
-        )
-        
-        if config.motherboard:
-            db_config.set_component('motherboard', config.motherboard.to_dict())
-        if config.cpu:
-            db_config.set_component('cpu', config.cpu.to_dict())
-        if config.ram_modules:
-            db_config.set_component('ram_modules', [m.to_dict() for m in config.ram_modules])
-        if config.storage_devices:
-            db_config.set_component('storage_devices', [s.to_dict() for s in config.storage_devices])
-        if config.gpu:
-            db_config.set_component('gpu', config.gpu.to_dict())
-        if config.network_adapters:
-            db_config.set_component('network_adapters', [n.to_dict() for n in config.network_adapters])
-        if config.psu:
-            db_config.set_component('psu', config.psu.to_dict())
-        
-        return db_config
+    def _insert_configurations(
+        self,
+        db: Session,
+        pc_id: str,
+        components: Dict[str, Optional[EncodedJSON]],
+        timestamp: datetime,
+        with_baseline: bool
+    ):
+        """Сохранить текущую конфигурацию (и эталонную, если with_baseline) одним INSERT"""
+        rows = [{'pc_id': pc_id, 'is_baseline': False, 'timestamp': timestamp, **components}]
+        if with_baseline:
+            rows.insert(0, {'pc_id': pc_id, 'is_baseline': True, 'timestamp': timestamp, **components})
+        db.execute(insert(DBPCConfiguration), rows)
     
     def start(self):
         """Запустить Consumer в отдельном потоке"""
@@ -194,18 +367,31 @@ class PCGuardianConsumer:
         try:
             while self.running:
                 try:
-                    message_pack = self.consumer.poll(timeout_ms=1000)
+                    message_pack = self.consumer.poll(timeout_ms=1000, max_records=self.POLL_BATCH_SIZE)
+                    if not message_pack:
+                        continue
+                    
+                    batch = [
+                        message.value
+                        for messages in message_pack.values()
+                        for message in messages
+                    ]
+                    try:
+                        self._process_batch(batch)
+                    except Exception as e:
+                        # Пачка не записана: смещения не фиксируем и читаем ее снова с начала.
+                        # Части, успевшие зафиксироваться в других потоках, будут обработаны повторно
+                        self.logger.error("Ошибка записи пачки сообщений, повтор: %s", e, exc_info=True)
+                        for tp, messages in message_pack.items():
+                            self.consumer.seek(tp, messages[0].offset)
+                        time.sleep(self.RETRY_DELAY)
+                        continue
                     
-                    for topic_partition, messages in message_pack.items():
-                        for message in messages:
-                            try:
-                                config_data = message.value
-                                self._process_configuration(config_data)
-                            except Exception as e:
-                                self.logger.error(f"Ошибка обработки сообщения: {e}", exc_info=True)
+                    # Смещения фиксируем один раз после обработки всей пачки
+                    self.consumer.commit()
                 
                 except KafkaError as e:
-                    self.logger.error(f"Ошибка Kafka: {e}")
+                    self.logger.error("Ошибка Kafka: %s", e)
                     # Пересоздаем consumer при ошибке
                     try:
                         self.consumer.close()
@@ -215,7 +401,7 @@ class PCGuardianConsumer:
                     self._create_consumer()
                 
         except Exception as e:
-            self.logger.error(f"Критическая ошибка в Consumer: {e}", exc_info=True)
+            self.logger.error("Критическая ошибка в Consumer: %s", e, exc_info=True)
         finally:
             if self.consumer:
                 try:
@@ -231,5 +417,7 @@ class PCGuardianConsumer:
                 self.consumer.close()
             except:
                 pass
+        # Не теряем уведомления, ожидающие окна объединения
+        self.notification_service.flush_pending()
         self.logger.info("Kafka Consumer остановлен")
 
@@ -3,10 +3,14 @@
 """
 import os
 import logging
+import queue
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Optional, List
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
 try:
@@ -17,15 +21,47 @@ except ImportError:
 from database import PC, ChangeEvent as DBChangeEvent
 
 
+# Названия типов изменений и компонентов для сообщений
+_EVENT_TYPE_RU = MappingProxyType({
+    'removed': 'удален',
+    'added': 'добавлен',
+    'replaced': 'заменен'
+})
+
+_COMPONENT_TYPE_RU = MappingProxyType({
+    'motherboard': 'Материнская плата',
+    'cpu': 'Процессор',
+    'ram': 'Оперативная память',
+    'storage': 'Накопитель',
+    'gpu': 'Видеокарта',
+    'network': 'Сетевой адаптер',
+    'psu': 'Блок питания'
+})
+
+
 class NotificationService:
     """Сервис для отправки уведомлений"""
     
+    # Максимум уведомлений, ожидающих отправки в одном канале; при переполнении новые отбрасываются
+    ALERT_QUEUE_SIZE = 1000
+    
+    # Окно (сек), в течение которого события одного ПК объединяются в одно уведомление
+    ALERT_DEBOUNCE_SECONDS = float(os.getenv('ALERT_DEBOUNCE_SECONDS', '2'))
+    # Число событий, при котором накопленное уведомление отправляется, не дожидаясь окна
+    ALERT_BATCH_MAX = 20
+    
+    # Простой SMTP-соединения (сек), после которого перед отправкой выполняется NOOP
+    SMTP_NOOP_INTERVAL = 60
+    
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         
         # Настройки Telegram
         self.telegram_bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
         self.telegram_chat_id = os.getenv('TELEGRAM_CHAT_ID')
+        # URL и общие поля запроса не меняются между уведомлениями
+        self._tg_url = f"https://api.telegram.org/bot{self.telegram_bot_token}/sendMessage" if self.telegram_bot_token else None
+        self._tg_base = {'chat_id': self.telegram_chat_id, 'parse_mode': 'HTML'}
         
         # Настройки Email
         self.smtp_host = os.getenv('SMTP_HOST', 'smtp.gmail.com')
@@ -34,63 +70,160 @@ class NotificationService:
         self.smtp_password = os.getenv('SMTP_PASSWORD')
         self.email_from = os.getenv('EMAIL_FROM', self.smtp_user)
         self.email_to = os.getenv('EMAIL_TO', '').split(',') if os.getenv('EMAIL_TO') else []
+        
+        # Накопленные события: pc_id -> (hostname, [события]) и таймеры их отправки
+        self._pending: Dict[str, Tuple[str, List[DBChangeEvent]]] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._pending_lock = threading.Lock()
+        
+        # У каждого канала свой фоновый поток с очередью: consumer не ждет сетевых вызовов,
+        # а Telegram и Email отправляются параллельно и не задерживают друг друга
+        self._http = None
+        self._telegram_queue = None
+        if requests and self.telegram_bot_token and self.telegram_chat_id:
+            # Одна HTTP-сессия (keep-alive к api.telegram.org)
+            self._http = requests.Session()
+            self._telegram_queue = self._start_worker("telegram-notifier", self._send_telegram)
+        
+        # Email: соединение с SMTP-сервером держится открытым между уведомлениями
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_lock = threading.Lock()
+        self._smtp_last_used = 0.0
+        
+        self._email_queue = None
+        if self.smtp_user and self.smtp_password and self.email_to:
+            self._email_queue = self._start_worker("email-notifier", self._send_email)
     
     def send_alert(self, pc: PC, event: DBChangeEvent):
         """
         Отправить уведомление об изменении
         
+        События одного ПК копятся в течение ALERT_DEBOUNCE_SECONDS и уходят одним сообщением
+        (или сразу, если набралось ALERT_BATCH_MAX событий).
+        
         Args:
             pc: Объект ПК
             event: Событие изменения
         """
-        message = self._format_alert_message(pc, event)
+        flush_now = False
+        with self._pending_lock:
+            pending = self._pending.get(pc.pc_id)
+            if pending is None:
+                # Запоминаем атрибуты ПК сейчас: к моменту отправки сессия БД уже закрыта
+                pending = self._pending[pc.pc_id] = (pc.hostname, [])
+                timer = threading.Timer(self.ALERT_DEBOUNCE_SECONDS, self._flush_pc, args=(pc.pc_id,))
+                timer.daemon = True
+                self._timers[pc.pc_id] = timer
+                timer.start()
+            pending[1].append(event)
+            flush_now = len(pending[1]) >= self.ALERT_BATCH_MAX
+        
+        if flush_now:
+            self._flush_pc(pc.pc_id)
+    
+    def flush_pending(self):
+        """Немедленно отправить все накопленные уведомления (например, при остановке)"""
+        with self._pending_lock:
+            pc_ids = list(self._pending)
+        for pc_id in pc_ids:
+            self._flush_pc(pc_id)
+    
+    def _flush_pc(self, pc_id: str):
+        """Отправить накопленные события ПК одним уведомлением"""
+        with self._pending_lock:
+            pending = self._pending.pop(pc_id, None)
+            timer = self._timers.pop(pc_id, None)
+        if timer is not None:
+            timer.cancel()
+        if pending is None:
+            return
         
-        # Отправляем через все доступные каналы
+        hostname, events = pending
+        if len(events) == 1:
+            message = self._format_alert_message(hostname, pc_id, events[0])
+        else:
+            message = self._format_alert_batch(hostname, pc_id, events)
+        self._dispatch(message, f"PC-Guardian: Изменение на {hostname}")
+    
+    def _dispatch(self, message: str, subject: str):
+        """Отправить сообщение через все доступные каналы"""
         if self.telegram_bot_token and self.telegram_chat_id:
-            self._send_telegram(message)
+            if self._telegram_queue is None:
+                # requests не установлена - _send_telegram сообщит об этом в лог
+                self._send_telegram(message)
+            else:
+                self._enqueue(self._telegram_queue, "Telegram", message)
         
-        if self.smtp_user and self.smtp_password and self.email_to:
-            self._send_email(message, f"PC-Guardian: Изменение на {pc.hostname}")
+        if self._email_queue is not None:
+            self._enqueue(self._email_queue, "Email", message, subject)
     
-    def _format_alert_message(self, pc: PC, event: DBChangeEvent) -> str:
+    def _format_alert_message(self, hostname: str, pc_id: str, event: DBChangeEvent) -> str:
         """Форматировать сообщение об изменении"""
-        event_type_ru = {
-            'removed': 'удален',
-            'added': 'добавлен',
-            'replaced': 'заменен'
-        }
-        
-        component_type_ru = {
-            'motherboard': 'Материнская плата',
-            'cpu': 'Процессор',
-            'ram': 'Оперативная память',
-            'storage': 'Накопитель',
-            'gpu': 'Видеокарта',
-            'network': 'Сетевой адаптер',
-            'psu': 'Блок питания'
-        }
-        
-        event_type = event_type_ru.get(event.event_type, event.event_type)
-        component_type = component_type_ru.get(event.component_type, event.component_type)
-        
-        message = f"⚠️ ВНИМАНИЕ: Изменение конфигурации ПК\n\n"
-        message += f"ПК: {pc.hostname} ({pc.pc_id})\n"
-        message += f"Компонент: {component_type}\n"
-        message += f"Тип изменения: {event_type}\n"
-        message += f"Время: {event.timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        lines = [
+            "⚠️ ВНИМАНИЕ: Изменение конфигурации ПК",
+            "",
+            f"ПК: {hostname} ({pc_id})",
+            f"Компонент: {_COMPONENT_TYPE_RU.get(event.component_type, event.component_type)}",
+            f"Тип изменения: {_EVENT_TYPE_RU.get(event.event_type, event.event_type)}",
+            f"Время: {event.timestamp.strftime('%Y-%m-%d %H:%M:%S')}",
+            "",
+        ]
         
         if event.details:
-            message += f"Детали: {event.details}\n\n"
+            lines += (f"Детали: {event.details}", "")
         
         if event.old_value:
             old_model = event.old_value.get('model') or event.old_value.get('name') or 'неизвестно'
-            message += f"Было: {old_model}\n"
+            lines.append(f"Было: {old_model}")
         
         if event.new_value:
             new_model = event.new_value.get('model') or event.new_value.get('name') or 'неизвестно'
-            message += f"Стало: {new_model}\n"
+            lines.append(f"Стало: {new_model}")
+        
+        lines.append("")
+        return "\n".join(lines)
+    
+    def _format_alert_batch(self, hostname: str, pc_id: str, events: List[DBChangeEvent]) -> str:
+        """Форматировать одно сообщение о нескольких изменениях ПК"""
+        lines = [
+            f"⚠️ ВНИМАНИЕ: Изменения конфигурации ПК ({len(events)})",
+            "",
+            f"ПК: {hostname} ({pc_id})",
+            f"Время: {events[0].timestamp.strftime('%Y-%m-%d %H:%M:%S')}",
+            "",
+        ]
         
-        return message
+        for event in events:
+            line = (f"• {_COMPONENT_TYPE_RU.get(event.component_type, event.component_type)}: "
+                    f"{_EVENT_TYPE_RU.get(event.event_type, event.event_type)}")
+            lines.append(f"{line} - {event.details}" if event.details else line)
+        
+        lines.append("")
+        return "\n".join(lines)
+    
+    def _start_worker(self, name: str, send) -> queue.Queue:
+        """Запустить фоновый поток, вызывающий send(*args) для элементов очереди"""
+        alert_queue = queue.Queue(maxsize=self.ALERT_QUEUE_SIZE)
+        threading.Thread(target=self._queue_worker, args=(alert_queue, send), name=name, daemon=True).start()
+        return alert_queue
+    
+    def _queue_worker(self, alert_queue: queue.Queue, send):
+        """Фоновый поток: отправляет уведомления из очереди"""
+        while True:
+            args = alert_queue.get()
+            try:
+                send(*args)
+            except Exception as e:
+                self.logger.error(f"Ошибка отправки уведомления: {e}")
+            finally:
+                alert_queue.task_done()
+    
+    def _enqueue(self, alert_queue: queue.Queue, channel: str, *args):
+        """Поставить уведомление в очередь канала"""
+        try:
+            alert_queue.put_nowait(args)
+        except queue.Full:
+            self.logger.warning(f"Очередь уведомлений {channel} переполнена, уведомление пропущено")
     
     def _send_telegram(self, message: str):
         """Отправить уведомление в Telegram"""
@@ -99,18 +232,48 @@ class NotificationService:
             return
         
         try:
-            url = f"https://api.telegram.org/bot{self.telegram_bot_token}/sendMessage"
-            data = {
-                'chat_id': self.telegram_chat_id,
-                'text': message,
-                'parse_mode': 'HTML'
-            }
-            response = requests.post(url, json=data, timeout=10)
+            data = {**self._tg_base, 'text': message}
+            response = self._http.post(self._tg_url, json=data, timeout=10)
             response.raise_for_status()
             self.logger.info("Уведомление отправлено в Telegram")
         except Exception as e:
             self.logger.error(f"Ошибка отправки в Telegram: {e}")
     
+    def _get_smtp(self) -> smtplib.SMTP:
+        """Получить открытое SMTP-соединение (создается при первом вызове, вызывать под _smtp_lock)"""
+        now = time.monotonic()
+        if self._smtp is not None and now - self._smtp_last_used > self.SMTP_NOOP_INTERVAL:
+            # После простоя проверяем, что сервер не закрыл соединение
+            try:
+                status, _ = self._smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                status = None
+            if status != 250:
+                self._close_smtp()
+        
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=30)
+            try:
+                smtp.starttls()
+                smtp.login(self.smtp_user, self.smtp_password)
+            except Exception:
+                smtp.close()
+                raise
+            self._smtp = smtp
+        
+        self._smtp_last_used = now
+        return self._smtp
+    
+    def _close_smtp(self):
+        """Закрыть SMTP-соединение (вызывать под _smtp_lock)"""
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+    
     def _send_email(self, message: str, subject: str):
         """Отправить уведомление по Email"""
         if not self.email_to:
@@ -124,10 +287,13 @@ class NotificationService:
             
             msg.attach(MIMEText(message, 'plain', 'utf-8'))
             
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_user, self.smtp_password)
-                server.send_message(msg)
+            with self._smtp_lock:
+                try:
+                    self._get_smtp().send_message(msg)
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPException, OSError):
+                    # Соединение могло быть закрыто сервером - переподключаемся один раз
+                    self._close_smtp()
+                    self._get_smtp().send_message(msg)
             
             self.logger.info(f"Уведомление отправлено по Email: {', '.join(self.email_to)}")
         except Exception as e:
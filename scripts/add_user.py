@@ -3,19 +3,51 @@
 """
 import sys
 import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
 
 # Добавляем корневую директорию проекта в путь
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 import bcrypt
+from sqlalchemy import inspect
 from database import Base, engine, SessionLocal, User
 
-def add_user(username: str, email: str, password: str, role: str = "viewer"):
+# Стоимость bcrypt; в тестовых окружениях можно задать BCRYPT_ROUNDS=4
+_BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Схема проверяется один раз за запуск; --skip-create отключает проверку
+_schema_ready = False
+
+def ensure_schema():
+    """Создать таблицы, если в БД еще нет таблицы пользователей"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    if not inspect(engine).has_table(User.__tablename__):
+        Base.metadata.create_all(bind=engine)
+    _schema_ready = True
+
+def hash_password(password: str, cost: int = _BCRYPT_ROUNDS) -> str:
+    """Хешировать пароль напрямую через bcrypt"""
+    password_bytes = password.encode('utf-8')
+    salt = bcrypt.gensalt(rounds=cost)
+    return bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+
+def add_user(
+    username: str,
+    email: str,
+    password: str,
+    role: str = "viewer",
+    cost: int = _BCRYPT_ROUNDS,
+    password_hash: Optional[str] = None
+):
     """Добавить пользователя в БД"""
     # Создаем таблицы, если их нет
-    Base.metadata.create_all(bind=engine)
+    ensure_schema()
     
     db = SessionLocal()
     try:
@@ -25,10 +57,9 @@ def add_user(username: str, email: str, password: str, role: str = "viewer"):
             print(f"Пользователь {username} уже существует")
             return
         
-        # Хешируем пароль напрямую через bcrypt
-        password_bytes = password.encode('utf-8')
-        salt = bcrypt.gensalt()
-        password_hash = bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+        # Хешируем пароль, если хеш не вычислен заранее
+        if password_hash is None:
+            password_hash = hash_password(password, cost)
         
         # Создаем пользователя
         user = User(
@@ -49,18 +80,36 @@ def add_user(username: str, email: str, password: str, role: str = "viewer"):
         db.close()
 
 if __name__ == "__main__":
-    if len(sys.argv) >= 4:
-        username = sys.argv[1]
-        email = sys.argv[2]
-        password = sys.argv[3]
-        role = sys.argv[4] if len(sys.argv) > 4 else "viewer"
-        add_user(username, email, password, role)
+    parser = argparse.ArgumentParser(description="Добавить пользователя в БД (без аргументов - пользователи по умолчанию)")
+    parser.add_argument("username", nargs="?")
+    parser.add_argument("email", nargs="?")
+    parser.add_argument("password", nargs="?")
+    parser.add_argument("role", nargs="?", default="viewer")
+    parser.add_argument("--cost", type=int, default=_BCRYPT_ROUNDS,
+                        help="стоимость bcrypt (по умолчанию BCRYPT_ROUNDS или 12; для тестов достаточно 4)")
+    parser.add_argument("--skip-create", action="store_true",
+                        help="не проверять и не создавать таблицы (схема уже создана)")
+    args = parser.parse_args()
+    
+    if args.skip_create:
+        _schema_ready = True
+    
+    if args.password:
+        add_user(args.username, args.email, args.password, args.role, cost=args.cost)
+    elif args.username:
+        parser.error("укажите username, email и password")
     else:
         # Создаем пользователей по умолчанию
         print("Создание пользователей по умолчанию...")
-        add_user("admin", "admin@pc-guardian.local", "admin", "admin")
-        add_user("viewer", "viewer@pc-guardian.local", "viewer", "viewer")
+        default_users = [
+            ("admin", "admin@pc-guardian.local", "admin", "admin"),
+            ("viewer", "viewer@pc-guardian.local", "viewer", "viewer"),
+        ]
+        # bcrypt освобождает GIL, поэтому пароли хешируются параллельно; запись в БД - последовательно
+        with ThreadPoolExecutor(max_workers=len(default_users)) as executor:
+            hashes = list(executor.map(lambda user: hash_password(user[2], args.cost), default_users))
+        for user, password_hash in zip(default_users, hashes):
+            add_user(*user, password_hash=password_hash)
         print("\nПользователи по умолчанию:")
         print("  admin/admin (администратор)")
         print("  viewer/viewer (просмотр)")
-